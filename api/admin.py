@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from api.models import Message
+from api.models import ArchivedMessage, Message, Task
 
 admin.site.register(Message)
+admin.site.register(ArchivedMessage)
+admin.site.register(Task)
@@ -0,0 +1,81 @@
+"""Hot/cold tiering of messages: old messages are moved from `api_message` to `api_archivedmessage`.
+
+`python manage.py archive_messages` moves messages not updated for `MESSAGES_ARCHIVE_AFTER_DAYS` days
+(by `updated_at`, read from `api_message_updated_id_idx`), so the hot table and its indexes stay small
+and list, search and most viewed endpoints only scan recent messages.
+
+Archived messages keep their ids and `api/messages/<id>` falls back to the archive on a miss
+(views of archived messages are counted in the archive). An update or delete of an archived message
+moves it back to the hot table first, so they work the same as for hot messages.
+Archiving is not a change of the message - it does not appear in the change feed,
+which reads archived messages like hot ones, so mirrors keep them.
+"""
+from django.db import connection, transaction
+from django.db.models import Max
+
+from api.cache import invalidate_messages
+from api.counters import get_view_counter
+from api.leaderboard import update_leaderboard
+from api.models import ArchivedMessage, Message, MessageChange
+
+ARCHIVED_FIELDS = ('id', 'content', 'views', 'created_at', 'updated_at', 'version')
+
+
+def archive_messages(before, batch_size):
+    """Moves messages updated before `before` to the archive, `batch_size` messages per transaction.
+    Returns number of archived messages.
+    """
+    counter = get_view_counter()
+    if counter is not None:
+        # buffered views are added to api_message rows, write them before the rows are moved
+        counter.flush()
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Message.objects.filter(updated_at__lt=before).order_by('updated_at', 'id')
+                .values(*ARCHIVED_FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+            ids = [row['id'] for row in rows]
+            ArchivedMessage.objects.bulk_create([ArchivedMessage(**row) for row in rows])
+            last_change = MessageChange.objects.aggregate(id=Max('id'))['id'] or 0
+            Message.objects.filter(id__in=ids).delete()
+            # drop tombstones logged by the delete trigger, mirrors keep the archived messages
+            MessageChange.objects.filter(id__gt=last_change, message_id__in=ids).delete()
+        invalidate_messages(ids)
+        update_leaderboard(removed=ids)
+        archived += len(ids)
+    return archived
+
+
+def restore_messages(pks):
+    """Moves archived messages with given ids back to the hot table, with their original timestamps
+    (INSERT ... SELECT, so the change log trigger records them as usual). Returns ids of restored messages.
+    """
+    with transaction.atomic():
+        restored = list(ArchivedMessage.objects.select_for_update().filter(id__in=pks).values_list('id', flat=True))
+        if not restored:
+            return []
+        columns = ', '.join(connection.ops.quote_name(field) for field in ARCHIVED_FIELDS)
+        placeholders = ', '.join(['%s'] * len(restored))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {Message._meta.db_table} ({columns}) '
+                f'SELECT {columns} FROM {ArchivedMessage._meta.db_table} WHERE id IN ({placeholders})',
+                restored,
+            )
+        ArchivedMessage.objects.filter(id__in=restored).delete()
+    invalidate_messages(restored)
+    return restored
+
+
+def restore_message(pk):
+    """Moves archived message `pk` back to the hot table. Returns False if it is not archived."""
+    return bool(restore_messages([pk]))
+
+
+def is_archived(pk):
+    return ArchivedMessage.objects.filter(id=pk).exists()
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from api.async_views import as_async_view, as_long_poll_changes_view, export_not_supported_view
+from api.views import GetUpdateDeleteMessageAPIView, ListCreateMessageAPIView
+
+urlpatterns = [
+    path('messages', as_async_view(ListCreateMessageAPIView)),
+    path('messages/changes', as_long_poll_changes_view()),
+    path('messages/export', export_not_supported_view),
+    path('messages/<int:id>', as_async_view(GetUpdateDeleteMessageAPIView)),
+]
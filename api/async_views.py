@@ -0,0 +1,89 @@
+"""Async versions of message views for ASGI deployments (see `core/asgi_urls.py`).
+
+Django 3.2 has no async ORM and DRF views are synchronous, so the sync views are run
+in a bounded pool of `MESSAGES_ASYNC_THREADS` threads while the event loop keeps serving
+other connections. Plain sync views under ASGI would all be run by one shared thread.
+With `MESSAGES_ASYNC_THREADS = 0` views run in Django's thread-sensitive executor instead
+(used by tests, which need the views to share the database connection of the test).
+"""
+import asyncio
+import contextvars
+import functools
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+from api.changes import has_changes_since
+from api.serializers import MessageChangesSerializer
+from api.views import MessageChangesAPIView
+from core.executors import get_executor, run_in_pool
+
+
+async def run_sync(func, *args, **kwargs):
+    """Runs blocking `func` in the pool (or in Django's thread-sensitive executor) and returns its result."""
+    if not settings.MESSAGES_ASYNC_THREADS:
+        return await sync_to_async(func)(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    # run_in_executor does not propagate context variables (e.g. timings of instrumented request)
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_executor('messages-api', settings.MESSAGES_ASYNC_THREADS),
+        functools.partial(context.run, run_in_pool, func, *args, **kwargs),
+    )
+
+
+def as_async_view(view_class, **initkwargs):
+    """Returns async view running `view_class` with the same behaviour as `view_class.as_view()`."""
+    view = view_class.as_view(**initkwargs)
+
+    def render(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        # render in the worker thread as well, not in the event loop
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        return response
+
+    async def async_view(request, *args, **kwargs):
+        return await run_sync(render, request, *args, **kwargs)
+
+    async_view.cls = view.cls
+    async_view.initkwargs = view.initkwargs
+    async_view.csrf_exempt = True
+    return async_view
+
+
+def as_long_poll_changes_view():
+    """Returns async change feed view which waits for changes in the event loop,
+    so long-polling clients do not hold threads of the pool.
+    """
+    view = as_async_view(MessageChangesAPIView)
+
+    async def changes_view(request, *args, **kwargs):
+        serializer = MessageChangesSerializer(data=request.GET)
+        if serializer.is_valid() and serializer.validated_data['wait']:
+            since = serializer.validated_data['since']
+            deadline = time.monotonic() + serializer.validated_data['wait']
+            while not await run_sync(has_changes_since, since):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(settings.MESSAGES_CHANGES_POLL_INTERVAL, remaining))
+            # the sync view must not wait again
+            request.changes_awaited = True
+        return await view(request, *args, **kwargs)
+
+    changes_view.cls = view.cls
+    changes_view.initkwargs = view.initkwargs
+    changes_view.csrf_exempt = True
+    return changes_view
+
+
+async def export_not_supported_view(request, *args, **kwargs):
+    """Refuses the streaming export: Django 3.2 ASGI handler iterates streaming responses in the event loop,
+    where the export queries would fail with SynchronousOnlyOperation after the headers were already sent.
+    """
+    return JsonResponse(
+        {'detail': 'Export is not supported by ASGI deployments, use manage.py export_messages.'}, status=501,
+    )
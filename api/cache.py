@@ -0,0 +1,73 @@
+"""Read-through cache of serialized message payloads and list pages.
+
+Enabled with `MESSAGES_CACHE_ENABLED`, entries are kept in the `MESSAGES_CACHE_ALIAS` cache
+(LRU locmem per process by default, filebased or memcached can be configured for shared cache).
+
+List pages are keyed by a generation number which is bumped on every write,
+so all of them are invalidated at once (any create/update/delete moves rows between pages).
+Message payloads are only cached when views are buffered (see `api.counters`) -
+with synchronous counting every GET writes the row and gets it back from the same statement anyway.
+Cached payloads are invalidated when the message changes and when its buffered views are flushed.
+View counts on cached list pages may be up to cache TIMEOUT seconds old.
+With read replicas, writes are remembered for `DATABASE_REPLICA_PIN_SECONDS`, pages which are cached meanwhile
+are read from the primary, so that a lagging replica does not put a stale page into the new generation.
+"""
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+
+LIST_GENERATION_KEY = 'messages:list:generation'
+LIST_WRITTEN_KEY = 'messages:list:written'
+
+
+def get_cache():
+    """Returns messages cache or None if caching is disabled."""
+    if not settings.MESSAGES_CACHE_ENABLED:
+        return None
+    return caches[settings.MESSAGES_CACHE_ALIAS]
+
+
+def detail_key(pk):
+    return f'messages:detail:{pk}'
+
+
+def list_key(cache, request):
+    """Returns cache key of list page requested by `request` in the current list generation."""
+    generation = cache.get(LIST_GENERATION_KEY)
+    if generation is None:
+        # start from current time, so that generation never goes back after eviction of the key
+        cache.add(LIST_GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(LIST_GENERATION_KEY)
+    url = md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'messages:list:{generation}:{url}'
+
+
+def invalidate_message_details(pks):
+    """Drops cached payloads of messages with given ids."""
+    cache = get_cache()
+    if cache is not None and pks:
+        cache.delete_many([detail_key(pk) for pk in pks])
+
+
+def invalidate_messages(pks):
+    """Drops cached payloads of messages with given ids and all cached list pages."""
+    cache = get_cache()
+    if cache is None:
+        return
+
+    invalidate_message_details(pks)
+    try:
+        cache.incr(LIST_GENERATION_KEY)
+    except ValueError:
+        cache.add(LIST_GENERATION_KEY, time.time_ns(), timeout=None)
+    if settings.DATABASE_REPLICAS:
+        cache.set(LIST_WRITTEN_KEY, True, timeout=settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def recently_written(cache):
+    """Returns True if messages have been written within `DATABASE_REPLICA_PIN_SECONDS`
+    (replicas may not have them yet).
+    """
+    return bool(cache.get(LIST_WRITTEN_KEY))
@@ -0,0 +1,103 @@
+"""Change feed of messages (`api/messages/changes`) for incremental sync of mirrors.
+
+Every insert, delete and update of content of a message appends a row to `MessageChange`.
+The log is written by database triggers (see migration `0007_messagechange`), in the same statement
+as the write, so writes keep their single queries and changes done outside the API are logged as well.
+Clients keep the id of the last change they have seen (cursor)
+and ask only for changes after it, so the cost of a sync depends on the number of changes,
+not on the number of messages - the log is read by primary key range.
+
+Changes of view counts are not logged (they happen on every GET of a message),
+mirrors get current view counts with every logged change of the message.
+
+Clients can long-poll: with `wait` the request is held until there is a change after the cursor
+(checked every `MESSAGES_CHANGES_POLL_INTERVAL` seconds) or until `wait` seconds pass.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from api.models import ArchivedMessage, Message, MessageChange
+from api.serializers import MESSAGE_FIELDS
+
+
+def change_horizon():
+    """Returns id below which all changes are committed (None if there is no such bound).
+
+    Ids are taken when changes are written, but transactions commit in any order, so on PostgreSQL
+    a committed change may be visible while a change with a lower id is not committed yet,
+    and a client whose cursor passed it would never see it. The first change of every transaction
+    takes a ticket from the change id sequence and holds an advisory lock on it until commit
+    (see migration `0010_messagechange_without_global_lock`), so the horizon is the lowest locked ticket.
+    The sequence is read first: transactions which take a ticket after the locks are read get higher ids.
+    SQLite serializes writers, changes are committed in order of their ids.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT last_value, is_called FROM api_messagechange_id_seq")
+        last_value, is_called = cursor.fetchone()
+        cursor.execute(
+            "SELECT min((classid::bigint << 32) | objid::bigint) FROM pg_locks "
+            "WHERE locktype = 'advisory' AND objsubid = 1 "
+            "AND database = (SELECT oid FROM pg_database WHERE datname = current_database())"
+        )
+        lowest_ticket = cursor.fetchone()[0]
+    horizon = (last_value if is_called else 0) + 1
+    return horizon if lowest_ticket is None else min(horizon, lowest_ticket)
+
+
+def committed_changes(cursor):
+    """Returns queryset of changes after `cursor` which are below the horizon."""
+    changes = MessageChange.objects.filter(id__gt=cursor)
+    horizon = change_horizon()
+    return changes if horizon is None else changes.filter(id__lt=horizon)
+
+
+def has_changes_since(cursor):
+    return committed_changes(cursor).exists()
+
+
+def wait_for_changes(cursor, timeout):
+    """Blocks until there is a change after `cursor` or `timeout` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while not has_changes_since(cursor):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(settings.MESSAGES_CHANGES_POLL_INTERVAL, remaining))
+    return True
+
+
+def changes_since(cursor, limit):
+    """Returns up to `limit` changes after `cursor` collapsed to the latest state of every message:
+    (new cursor, has more changes, rows of saved messages, ids of deleted messages).
+    Messages changed and deleted later are reported as deleted, archived messages as saved.
+    """
+    changes = list(
+        committed_changes(cursor).order_by('id')
+        .values_list('id', 'message_id', 'deleted')[:limit + 1]
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if not changes:
+        return cursor, False, [], []
+
+    latest = {}
+    for change_id, message_id, deleted in changes:
+        latest.pop(message_id, None)
+        latest[message_id] = deleted
+    saved = [message_id for message_id, deleted in latest.items() if not deleted]
+    rows = {row.id: row for row in Message.objects.filter(id__in=saved).values_list(*MESSAGE_FIELDS, named=True)}
+    archived = [message_id for message_id in saved if message_id not in rows]
+    if archived:
+        # archiving is not a change, archived messages are reported as saved
+        rows.update(
+            (row.id, row) for row in
+            ArchivedMessage.objects.filter(id__in=archived).values_list(*MESSAGE_FIELDS, named=True)
+        )
+    # ordered by their latest change, messages deleted after the change are reported as deleted
+    messages = [rows[message_id] for message_id in saved if message_id in rows]
+    deleted = [message_id for message_id, is_deleted in latest.items() if is_deleted or message_id not in rows]
+    return changes[-1][0], has_more, messages, deleted
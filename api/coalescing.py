@@ -0,0 +1,60 @@
+"""Single-flight coalescing of concurrent reads of the same message (`MESSAGES_COALESCE_READS`).
+
+When a message gets popular, many requests for it arrive at the same time and each of them
+would make its own database round trip. With coalescing, the first request (leader) fetches the message
+and requests for the same message which arrive while the fetch is running (followers) wait for it
+and share its result instead of querying the database themselves.
+
+Calls are coalesced within a process (between threads of a threaded WSGI server or of the async views' pool).
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.callers = 1
+
+
+class SingleFlight:
+    """Runs concurrent calls with the same key only once."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Runs `func` unless a call with the same `key` is already running, in which case waits for it.
+        Returns (result, index, callers) - the shared result, position of this caller (0 for the caller which
+        ran `func`) and number of callers which shared it. Errors of `func` are raised in all callers.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.callers += 1
+                index = call.callers - 1
+            else:
+                call = self._calls[key] = _Call()
+                index = 0
+
+        if index:
+            call.done.wait()
+        else:
+            try:
+                call.result = func()
+            except BaseException as error:
+                call.error = error
+            finally:
+                # callers arriving from now on start a new call
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, index, call.callers
+
+
+message_reads = SingleFlight()
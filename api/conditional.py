@@ -0,0 +1,86 @@
+"""Conditional GET support (ETag / Last-Modified / 304) for message endpoints.
+
+Validators of a list page come from the rows of the page (ids, `updated_at` and views), which are fetched
+by the page query anyway, so an unchanged page costs one index range scan and no serialization.
+Unpaginated lists are validated by one aggregate query (latest `updated_at`, number of messages and their views)
+instead of fetching all rows.
+ETag of a message is its `version`, which is incremented by every update,
+so it also serves optimistic concurrency of updates (If-Match, see `if_match_versions`).
+
+View counts are not part of message validators - they change on every GET of the message,
+so including them would make 304 responses impossible. 304 means that content did not change,
+view counts the client has may be outdated. A 304 from message endpoint still counts as a view.
+List pages with views (all but `?fields=` without `views`) include the total of views in their ETag,
+so that clients polling view counts see new ones. List ETags are weak, as pages read from cache
+may carry older view counts.
+"""
+from hashlib import md5
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, quote_etag
+
+
+def list_validators(queryset, request, views=False):
+    """Returns (weak ETag, Last-Modified) of the unpaginated list of `queryset` requested by `request`.
+    With `views` (the page includes view counts) the ETag changes with the total of views as well.
+    """
+    aggregates = {'last_modified': Max('updated_at'), 'count': Count('id')}
+    if views:
+        aggregates['views'] = Sum('views')
+    stats = queryset.aggregate(**aggregates)
+    last_modified = stats['last_modified']
+    version = (f"{stats['count']}:{last_modified.isoformat() if last_modified else ''}:{stats.get('views')}:"
+               f"{request.get_full_path()}")
+    return weak_etag(version), last_modified
+
+
+def page_validators(page, request, views=False, links=()):
+    """Returns (weak ETag, Last-Modified) of list page made of fetched `page` rows (with `id`, `updated_at`
+    and `views` if `views`). `links` (e.g. whether there are next and previous pages) are part of the page as well.
+    """
+    last_modified = max((row.updated_at for row in page), default=None)
+    rows = ','.join(f'{row.id}:{row.updated_at.isoformat()}:{row.views if views else ""}' for row in page)
+    return weak_etag(f'{rows}:{links}:{request.get_full_path()}'), last_modified
+
+
+def weak_etag(version):
+    return f'W/{quote_etag(md5(version.encode()).hexdigest())}'
+
+
+def message_etag(message):
+    return quote_etag(f'{message.id}-v{message.version}')
+
+
+def if_match_versions(request, pk):
+    """Returns versions of message `pk` listed in request's If-Match header,
+    None if the header is missing or it is `*` (update of any version).
+    Weak ETags never match (If-Match uses strong comparison).
+    """
+    header = request.META.get('HTTP_IF_MATCH')
+    if header is None:
+        return None
+    etags = parse_etags(header)
+    if etags == ['*']:
+        return None
+    prefix = f'"{pk}-v'
+    versions = [etag[len(prefix):-1] for etag in etags if etag.startswith(prefix)]
+    return [int(version) for version in versions if version.isdigit()]
+
+
+def not_modified(request, etag, last_modified=None):
+    """Returns 304 (or 412 for failed If-Match/If-Unmodified-Since) response
+    if request's preconditions are evaluated against given validators, None otherwise.
+    """
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified is not None else None,
+    )
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
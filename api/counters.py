@@ -0,0 +1,261 @@
+"""Buffered view counters for messages.
+
+By default every GET on `api/messages/<id>` increments `Message.views` with its own UPDATE.
+With `MESSAGES_VIEW_COUNTER` set, increments are collected in a buffer instead
+and written to the database in bulk once `MESSAGES_VIEW_FLUSH_THRESHOLD` views are pending
+or `MESSAGES_VIEW_FLUSH_INTERVAL` seconds have passed since the last flush
+(by a background task, see `core.tasks` - with `TASKS_MODE = 'thread'` GETs do not wait for it).
+A timer flushes views buffered by the last GETs, when traffic stops, after the interval as well.
+
+Backends:
+    local  - in-process buffer, every worker flushes its own increments
+             (flushes are additive, so workers never overwrite each other)
+    sqlite - buffer kept in a SQLite file shared by all workers on the host,
+             which can also be flushed from outside with `manage.py flush_views`
+
+Buffered increments are flushed on interpreter exit as well.
+"""
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+
+from api.cache import invalidate_message_details
+from api.models import Message
+from core.tasks import task
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 500
+
+
+def apply_view_deltas(deltas):
+    """Adds buffered views to `Message.views`, one UPDATE per `FLUSH_BATCH_SIZE` messages."""
+    pks = list(deltas)
+    with transaction.atomic():
+        for start in range(0, len(pks), FLUSH_BATCH_SIZE):
+            batch = pks[start:start + FLUSH_BATCH_SIZE]
+            increment = Case(
+                *[When(id=pk, then=Value(deltas[pk])) for pk in batch],
+                default=Value(0),
+                output_field=PositiveIntegerField(),
+            )
+            Message.objects.filter(id__in=batch).update(views=F('views') + increment)
+
+
+class ViewCounter(ABC):
+    """Base class of view buffers. Subclasses implement the storage."""
+
+    def __init__(self, flush_interval, flush_threshold):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.last_flush = time.monotonic()
+        self.flush_scheduled = False
+        self._timer = None
+        self._timer_lock = threading.Lock()
+
+    def incr(self, pk):
+        """Records a view of message `pk`.
+        Returns the number of its views which are not yet saved in the database (including this one).
+        """
+        pending, total = self._incr(pk)
+        if not self.flush_scheduled and (
+            total >= self.flush_threshold or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            # flush off the request path (see `core.tasks`), only one at a time
+            self.flush_scheduled = True
+            try:
+                flush_counter.delay(self)
+            except Exception:
+                self.flush_scheduled = False
+                raise
+        else:
+            self._start_timer()
+        return pending
+
+    def _start_timer(self):
+        """Makes sure that buffered views are flushed `flush_interval` seconds later even if no other view comes."""
+        with self._timer_lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_on_timer(self):
+        with self._timer_lock:
+            self._timer = None
+        try:
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+            else:
+                self._start_timer()  # flushed meanwhile, check again later
+        except Exception:
+            logger.exception('Flush of buffered views failed.')
+        finally:
+            connections.close_all()
+
+    @abstractmethod
+    def discard(self, pk):
+        """Drops buffered views of message `pk` (e.g. when its view count is reset)."""
+
+    def flush(self):
+        """Writes all buffered views to the database. Returns flushed {message id: views}."""
+        self.last_flush = time.monotonic()
+        self.flush_scheduled = False
+        deltas = self._drain()
+        if deltas:
+            try:
+                apply_view_deltas(deltas)
+            except Exception:
+                self._restore(deltas)
+                raise
+            # cached payloads do not include buffered views anymore
+            invalidate_message_details(list(deltas))
+        return deltas
+
+    @abstractmethod
+    def _incr(self, pk):
+        """Adds a view of message `pk` to the buffer, returns (its buffered views, all buffered views)."""
+
+    @abstractmethod
+    def _drain(self):
+        """Empties the buffer, returns {message id: views} which were in it."""
+
+    @abstractmethod
+    def _restore(self, deltas):
+        """Puts back drained views whose flush failed."""
+
+
+@task(local=True)
+def flush_counter(counter):
+    counter.flush()
+
+
+class LocalViewCounter(ViewCounter):
+    """Buffers views in memory of the current process."""
+
+    def __init__(self, flush_interval, flush_threshold):
+        super().__init__(flush_interval, flush_threshold)
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._total = 0
+
+    def _incr(self, pk):
+        with self._lock:
+            self._pending[pk] += 1
+            self._total += 1
+            return self._pending[pk], self._total
+
+    def discard(self, pk):
+        with self._lock:
+            self._total -= self._pending.pop(pk, 0)
+
+    def _drain(self):
+        with self._lock:
+            deltas, self._pending, self._total = dict(self._pending), Counter(), 0
+        return deltas
+
+    def _restore(self, deltas):
+        with self._lock:
+            self._pending.update(deltas)
+            self._total += sum(deltas.values())
+
+
+class SQLiteViewCounter(ViewCounter):
+    """Buffers views in a SQLite file, so that all processes on the host share one buffer."""
+
+    def __init__(self, path, flush_interval, flush_threshold):
+        super().__init__(flush_interval, flush_threshold)
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS pending_views '
+                '(message_id INTEGER PRIMARY KEY, views INTEGER NOT NULL)'
+            )
+            self._local.connection = connection
+        return connection
+
+    def _add(self, connection, deltas):
+        connection.executemany(
+            'INSERT INTO pending_views (message_id, views) VALUES (?, ?) '
+            'ON CONFLICT (message_id) DO UPDATE SET views = views + excluded.views',
+            deltas.items(),
+        )
+
+    def _incr(self, pk):
+        connection = self.connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            self._add(connection, {pk: 1})
+            pending, = connection.execute(
+                'SELECT views FROM pending_views WHERE message_id = ?', (pk,)
+            ).fetchone()
+            total, = connection.execute('SELECT TOTAL(views) FROM pending_views').fetchone()
+        return pending, total
+
+    def discard(self, pk):
+        connection = self.connection
+        with connection:
+            connection.execute('DELETE FROM pending_views WHERE message_id = ?', (pk,))
+
+    def _drain(self):
+        connection = self.connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            deltas = dict(connection.execute('SELECT message_id, views FROM pending_views'))
+            connection.execute('DELETE FROM pending_views')
+        return deltas
+
+    def _restore(self, deltas):
+        connection = self.connection
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            self._add(connection, deltas)
+
+
+_counter = None
+_counter_config = None
+_counter_lock = threading.Lock()
+
+
+def get_view_counter():
+    """Returns the configured view counter or None if views are saved on every request."""
+    global _counter, _counter_config
+    config = (
+        settings.MESSAGES_VIEW_COUNTER,
+        settings.MESSAGES_VIEW_COUNTER_PATH,
+        settings.MESSAGES_VIEW_FLUSH_INTERVAL,
+        settings.MESSAGES_VIEW_FLUSH_THRESHOLD,
+    )
+    if config == _counter_config:
+        return _counter
+
+    with _counter_lock:
+        if config != _counter_config:
+            backend, path, interval, threshold = config
+            if not backend:
+                counter = None
+            elif backend == 'local':
+                counter = LocalViewCounter(interval, threshold)
+            elif backend == 'sqlite':
+                counter = SQLiteViewCounter(path, interval, threshold)
+            else:
+                raise ValueError(f"Unknown MESSAGES_VIEW_COUNTER backend: {backend!r}")
+            if counter is not None:
+                atexit.register(counter.flush)
+            _counter, _counter_config = counter, config
+    return _counter
@@ -0,0 +1,29 @@
+"""Streaming NDJSON export of messages.
+
+Messages are read with `QuerySet.iterator()` (server-side cursor on PostgreSQL) in chunks
+of `MESSAGES_EXPORT_CHUNK_SIZE` rows and written one JSON object per line,
+so memory usage does not depend on the number of exported messages.
+"""
+import json
+
+from api.models import Message
+from api.serializers import MESSAGE_FIELDS, iter_serialized_messages
+
+
+def export_queryset(updated_since=None, updated_until=None):
+    """Returns messages updated in [updated_since, updated_until), oldest first.
+    Half-open range lets incremental exports use previous `updated_until` as next `updated_since`.
+    """
+    queryset = Message.objects.order_by('updated_at', 'id')
+    if updated_since is not None:
+        queryset = queryset.filter(updated_at__gte=updated_since)
+    if updated_until is not None:
+        queryset = queryset.filter(updated_at__lt=updated_until)
+    return queryset
+
+
+def iter_ndjson(queryset, chunk_size):
+    """Yields messages from queryset serialized as NDJSON lines."""
+    rows = queryset.values_list(*MESSAGE_FIELDS, named=True).iterator(chunk_size=chunk_size)
+    for message in iter_serialized_messages(rows):
+        yield json.dumps(message, ensure_ascii=False) + '\n'
@@ -0,0 +1,81 @@
+"""Most viewed messages (`api/messages/top`).
+
+Top `MESSAGES_TOP_SIZE` messages are read from index `api_message_views_id_idx`
+and, if messages cache is enabled (see `api.cache`), kept in the cache as a leaderboard
+which is updated in place whenever a message is viewed, created, updated or deleted,
+so it does not have to be read from the database again.
+
+Leaderboard always holds the exact top of all messages, but it may be shorter than `MESSAGES_TOP_SIZE`:
+when a message drops out of it (its views are reset or it is deleted), the next one is unknown
+and it is only read from the database when a client asks for more messages than the leaderboard holds.
+Concurrent updates from several workers may overwrite each other, so the leaderboard
+expires after cache TIMEOUT like other cached entries.
+Writes update it in the background (`update_leaderboard.delay`, see `core.tasks`), views inline.
+"""
+from django.conf import settings
+
+from api.cache import get_cache
+from api.models import Message
+from api.serializers import MESSAGE_FIELDS, serialize_messages
+from core.tasks import task
+
+LEADERBOARD_KEY = 'messages:top'
+
+
+def sort_key(message):
+    return message['views'], message['id']
+
+
+def query_top_messages(n):
+    """Reads `n` most viewed messages from the database (ties broken by newer id)."""
+    rows = Message.objects.order_by('-views', '-id').values_list(*MESSAGE_FIELDS, named=True)[:n]
+    return serialize_messages(rows)
+
+
+def top_messages(n):
+    """Returns `n` most viewed messages (serialized), from the leaderboard if it is cached."""
+    cache = get_cache()
+    if cache is None:
+        return query_top_messages(n)
+
+    leaderboard = cache.get(LEADERBOARD_KEY)
+    if leaderboard is None or (len(leaderboard['messages']) < n and not leaderboard['complete']):
+        messages = query_top_messages(settings.MESSAGES_TOP_SIZE)
+        # complete - leaderboard holds all messages, so every message can be added to it
+        leaderboard = {'messages': messages, 'complete': len(messages) < settings.MESSAGES_TOP_SIZE}
+        cache.set(LEADERBOARD_KEY, leaderboard)
+    return leaderboard['messages'][:n]
+
+
+@task
+def update_leaderboard(messages=(), removed=()):
+    """Updates cached leaderboard with current state of `messages` (serialized) and drops `removed` ids.
+    Messages without id (not saved) are ignored.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    leaderboard = cache.get(LEADERBOARD_KEY)
+    if leaderboard is None:
+        # built on the next read
+        return
+
+    messages = [message for message in messages if message['id'] is not None]
+    previous = {message['id']: message for message in leaderboard['messages']}
+    dropped = set(removed) | {message['id'] for message in messages}
+    kept = [message for message in leaderboard['messages'] if message['id'] not in dropped]
+    lowest = sort_key(kept[-1]) if kept else None
+    added = [
+        message for message in messages
+        # message belongs to the leaderboard if it ranks above its last message, or if it was there
+        # and only gained views (the ones below it are unknown if leaderboard is not complete)
+        if leaderboard['complete']
+        or (lowest is not None and sort_key(message) > lowest)
+        or (message['id'] in previous and sort_key(message) >= sort_key(previous[message['id']]))
+    ]
+    if not added and len(kept) == len(leaderboard['messages']):
+        return
+
+    updated = sorted(kept + added, key=sort_key, reverse=True)
+    complete = leaderboard['complete'] and len(updated) <= settings.MESSAGES_TOP_SIZE
+    cache.set(LEADERBOARD_KEY, {'messages': updated[:settings.MESSAGES_TOP_SIZE], 'complete': complete})
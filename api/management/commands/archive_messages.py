@@ -0,0 +1,25 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = "Moves messages which have not been updated for given number of days to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=settings.MESSAGES_ARCHIVE_AFTER_DAYS,
+                            help="Archive messages not updated for this many days")
+        parser.add_argument('--batch-size', type=int, default=settings.MESSAGES_ARCHIVE_BATCH_SIZE,
+                            help="Number of messages moved in one transaction")
+
+    def handle(self, *args, **options):
+        if options['older_than'] < 0 or options['batch_size'] < 1:
+            raise CommandError("--older-than must not be negative and --batch-size must be positive.")
+
+        before = timezone.now() - datetime.timedelta(days=options['older_than'])
+        count = archive_messages(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {count} messages updated before {before.isoformat()}."))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks.api import FLOWS, compare, run
+from benchmarks.utils import test_database
+
+
+class Command(BaseCommand):
+    help = "Seeds a throwaway test database and load tests API endpoints, prints results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000, help="Number of seeded messages")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per flow")
+        parser.add_argument('--auth-requests', type=int, default=10,
+                            help="Requests per register/token flow (password hashing is slow on purpose)")
+        parser.add_argument('--flows', nargs='+', choices=FLOWS, default=list(FLOWS))
+        parser.add_argument('--transports', nargs='+', choices=['client', 'live'], default=['client', 'live'],
+                            help="Django test client and/or HTTP requests to a live server in background thread")
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Concurrent requests to live server (not with in-memory SQLite)")
+        parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+        parser.add_argument('--compare', help="Report of previous run to compare with")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['auth_requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests, --auth-requests and --concurrency must be positive.")
+        if 'delete' in options['flows'] and \
+                options['messages'] < options['requests'] * len(options['transports']):
+            raise CommandError("Not enough messages for delete flow, increase --messages.")
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)
+
+        with test_database():
+            report = run(
+                messages=options['messages'],
+                requests=options['requests'],
+                auth_requests=options['auth_requests'],
+                flows=options['flows'],
+                transports=options['transports'],
+                concurrency=options['concurrency'],
+            )
+        if baseline is not None:
+            report = compare(report, baseline)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Saved benchmark report to {options['output']}."))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.export import export_queryset, iter_ndjson
+from api.serializers import ExportMessagesSerializer
+
+
+class Command(BaseCommand):
+    help = "Exports messages as NDJSON (one JSON object per line) to stdout or given file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+        parser.add_argument('--updated-since', help="Export messages updated at or after this ISO 8601 datetime")
+        parser.add_argument('--updated-until', help="Export messages updated before this ISO 8601 datetime")
+        parser.add_argument('--chunk-size', type=int, default=settings.MESSAGES_EXPORT_CHUNK_SIZE,
+                            help="Number of rows fetched from database at once")
+
+    def handle(self, *args, **options):
+        serializer = ExportMessagesSerializer(data={
+            key: options[key] for key in ('updated_since', 'updated_until') if options[key]
+        })
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+
+        lines = iter_ndjson(export_queryset(**serializer.validated_data), options['chunk_size'])
+        if options['output']:
+            count = 0
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                for line in lines:
+                    file.write(line)
+                    count += 1
+            self.stderr.write(self.style.SUCCESS(f"Exported {count} messages to {options['output']}."))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import get_view_counter
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes buffered message views to the database. "
+        "Run it on shutdown when MESSAGES_VIEW_COUNTER is 'sqlite' "
+        "('local' buffers are flushed by the worker processes themselves on exit)."
+    )
+
+    def handle(self, *args, **options):
+        counter = get_view_counter()
+        if counter is None:
+            self.stdout.write("View counter is not buffered (MESSAGES_VIEW_COUNTER is not set).")
+            return
+
+        deltas = counter.flush()
+        self.stdout.write(self.style.SUCCESS(
+            f"Flushed {sum(deltas.values())} views of {len(deltas)} messages."
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from core.tasks import run_due_tasks
+
+
+class Command(BaseCommand):
+    help = "Runs background tasks stored in the database (TASKS_MODE = 'db') until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run tasks which are due now and exit")
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of tasks claimed at once")
+        parser.add_argument('--poll-interval', type=float, default=settings.TASKS_POLL_INTERVAL,
+                            help="Seconds to wait when there are no due tasks")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['poll_interval'] <= 0:
+            raise CommandError("--batch-size and --poll-interval must be positive.")
+
+        processed = 0
+        try:
+            while True:
+                claimed = run_due_tasks(options['batch_size'])
+                processed += claimed
+                if claimed < options['batch_size']:
+                    if options['once']:
+                        break
+                    # drop connections the database has closed while the worker was idle
+                    close_old_connections()
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} tasks."))
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_message_views'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['-updated_at', '-id'], name='api_message_updated_id_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations
+
+POSTGRESQL_FORWARD = [
+    "CREATE INDEX api_message_content_search_idx ON api_message USING GIN (to_tsvector('simple', content))",
+]
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX IF EXISTS api_message_content_search_idx',
+]
+
+# external content FTS5 table - stores only the index, content is read from api_message
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE api_message_fts USING fts5(content, content='api_message', content_rowid='id')",
+    'CREATE TRIGGER api_message_fts_insert AFTER INSERT ON api_message BEGIN '
+    'INSERT INTO api_message_fts (rowid, content) VALUES (new.id, new.content); '
+    'END',
+    'CREATE TRIGGER api_message_fts_delete AFTER DELETE ON api_message BEGIN '
+    "INSERT INTO api_message_fts (api_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    'END',
+    'CREATE TRIGGER api_message_fts_update AFTER UPDATE OF content ON api_message BEGIN '
+    "INSERT INTO api_message_fts (api_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    'INSERT INTO api_message_fts (rowid, content) VALUES (new.id, new.content); '
+    'END',
+    "INSERT INTO api_message_fts (api_message_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS api_message_fts_insert',
+    'DROP TRIGGER IF EXISTS api_message_fts_delete',
+    'DROP TRIGGER IF EXISTS api_message_fts_update',
+    'DROP TABLE IF EXISTS api_message_fts',
+]
+
+
+def run_statements(statements):
+    def run(apps, schema_editor):
+        vendor_statements = statements.get(schema_editor.connection.vendor, [])
+        for statement in vendor_statements:
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_message_updated_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'postgresql': POSTGRESQL_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            run_statements({'postgresql': POSTGRESQL_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_message_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['-views', '-id'], name='api_message_views_id_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.3 on 2026-10-18 12:51
+from django.db import migrations, models
+
+from api.sql import SQLITE_SEARCH_TRIGGERS
+
+
+def create_search_triggers(apps, schema_editor):
+    # SQLite adds the column by rebuilding api_message, which drops its FTS5 triggers
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_SEARCH_TRIGGERS:
+            schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_message_views_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_triggers),
+        migrations.AddField(
+            model_name='message',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(create_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 3.2.3 on 2026-10-18 12:54
+from django.db import migrations, models
+
+from api.sql import run_statements
+
+# log every insert, delete and update of content/version (not of views) of api_message
+POSTGRESQL_FORWARD = [
+    'CREATE FUNCTION api_message_log_change() RETURNS trigger AS $$ '
+    'BEGIN '
+    # serializes writers until commit, so changes are committed in order of their ids
+    # and readers of the log never skip a change which is committed later with a lower id
+    "PERFORM pg_advisory_xact_lock(hashtext('api_messagechange')); "
+    "IF TG_OP = 'DELETE' THEN "
+    'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (OLD.id, true, now()); '
+    'RETURN OLD; '
+    'END IF; '
+    'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (NEW.id, false, now()); '
+    'RETURN NEW; '
+    'END $$ LANGUAGE plpgsql',
+    'CREATE TRIGGER api_message_change_insert_delete AFTER INSERT OR DELETE ON api_message '
+    'FOR EACH ROW EXECUTE PROCEDURE api_message_log_change()',
+    'CREATE TRIGGER api_message_change_update AFTER UPDATE OF content, version ON api_message FOR EACH ROW '
+    'WHEN (OLD.content IS DISTINCT FROM NEW.content OR OLD.version IS DISTINCT FROM NEW.version) '
+    'EXECUTE PROCEDURE api_message_log_change()',
+]
+POSTGRESQL_BACKWARD = [
+    'DROP TRIGGER IF EXISTS api_message_change_insert_delete ON api_message',
+    'DROP TRIGGER IF EXISTS api_message_change_update ON api_message',
+    'DROP FUNCTION IF EXISTS api_message_log_change()',
+]
+
+# SQLite serializes writers itself, recreate these after every rebuild of api_message (like FTS5 triggers)
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+SQLITE_TRIGGERS = [
+    'CREATE TRIGGER api_message_change_insert AFTER INSERT ON api_message BEGIN '
+    f'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (new.id, 0, {SQLITE_NOW}); '
+    'END',
+    'CREATE TRIGGER api_message_change_delete AFTER DELETE ON api_message BEGIN '
+    f'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (old.id, 1, {SQLITE_NOW}); '
+    'END',
+    'CREATE TRIGGER api_message_change_update AFTER UPDATE OF content, version ON api_message '
+    'WHEN new.content IS NOT old.content OR new.version IS NOT old.version BEGIN '
+    f'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (new.id, 0, {SQLITE_NOW}); '
+    'END',
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS api_message_change_insert',
+    'DROP TRIGGER IF EXISTS api_message_change_delete',
+    'DROP TRIGGER IF EXISTS api_message_change_update',
+]
+
+
+def log_existing_messages(apps, schema_editor):
+    """Starts the change log with all existing messages, so that a sync from cursor 0 gets all of them."""
+    Message = apps.get_model('api', 'Message')
+    MessageChange = apps.get_model('api', 'MessageChange')
+    using = schema_editor.connection.alias
+    ids = Message.objects.using(using).order_by('updated_at', 'id').values_list('id', flat=True)
+    MessageChange.objects.using(using).bulk_create(
+        [MessageChange(message_id=pk) for pk in ids.iterator()], batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_message_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(log_existing_messages, migrations.RunPython.noop),
+        migrations.RunPython(
+            run_statements({'postgresql': POSTGRESQL_FORWARD, 'sqlite': SQLITE_TRIGGERS}),
+            run_statements({'postgresql': POSTGRESQL_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
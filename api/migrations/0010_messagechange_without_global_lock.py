@@ -0,0 +1,51 @@
+from django.db import migrations
+
+from api.sql import run_statements
+
+# PostgreSQL only (SQLite serializes writers itself): writers no longer take one global lock.
+# The first change of every transaction takes a ticket from the change id sequence and holds
+# an advisory lock on it until commit. Its changes get higher ids than the ticket, so readers
+# return only changes below the lowest ticket of transactions in flight (see api.changes.change_horizon).
+POSTGRESQL_FORWARD = [
+    'CREATE OR REPLACE FUNCTION api_message_log_change() RETURNS trigger AS $$ '
+    'DECLARE ticket bigint; '
+    'BEGIN '
+    "IF COALESCE(current_setting('api.change_ticket', true), '') = '' THEN "
+    "ticket := nextval(pg_get_serial_sequence('api_messagechange', 'id')); "
+    'PERFORM pg_advisory_xact_lock(ticket); '
+    "PERFORM set_config('api.change_ticket', ticket::text, true); "
+    'END IF; '
+    "IF TG_OP = 'DELETE' THEN "
+    'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (OLD.id, true, now()); '
+    'RETURN OLD; '
+    'END IF; '
+    'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (NEW.id, false, now()); '
+    'RETURN NEW; '
+    'END $$ LANGUAGE plpgsql',
+]
+POSTGRESQL_BACKWARD = [
+    'CREATE OR REPLACE FUNCTION api_message_log_change() RETURNS trigger AS $$ '
+    'BEGIN '
+    "PERFORM pg_advisory_xact_lock(hashtext('api_messagechange')); "
+    "IF TG_OP = 'DELETE' THEN "
+    'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (OLD.id, true, now()); '
+    'RETURN OLD; '
+    'END IF; '
+    'INSERT INTO api_messagechange (message_id, deleted, created_at) VALUES (NEW.id, false, now()); '
+    'RETURN NEW; '
+    'END $$ LANGUAGE plpgsql',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_task'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'postgresql': POSTGRESQL_FORWARD}),
+            run_statements({'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
@@ -1,4 +1,51 @@
-from django.db import models
+from django.core.exceptions import EmptyResultSet
+from django.db import models, transaction
+from django.db.models import F, sql
+
+
+def supports_update_returning(connection):
+    """Checks if database supports `UPDATE ... RETURNING` (PostgreSQL, SQLite 3.35+)."""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+class MessageQuerySet(models.QuerySet):
+    def update_returning(self, **kwargs):
+        """Same as update(), but returns updated rows as model instances.
+        Uses single `UPDATE ... RETURNING` statement when database supports it,
+        otherwise locks rows, updates them and selects them again in one transaction.
+        """
+        self._for_write = True
+        connection = transaction.get_connection(self.db)
+        if not supports_update_returning(connection):
+            with transaction.atomic(using=self.db):
+                pks = list(self.select_for_update().values_list('pk', flat=True))
+                if not pks:
+                    return []
+                self.model._base_manager.using(self.db).filter(pk__in=pks).update(**kwargs)
+                return list(self.model._base_manager.using(self.db).filter(pk__in=pks))
+
+        query = self.query.chain(sql.UpdateQuery)
+        query.add_update_values(kwargs)
+        compiler = query.get_compiler(self.db)
+        compiler.pre_sql_setup()
+        try:
+            update_sql, params = compiler.as_sql()
+        except EmptyResultSet:
+            # filter which matches nothing, e.g. id__in=[]
+            return []
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(field.column) for field in self.model._meta.concrete_fields)
+        return list(self.model._base_manager.raw(
+            f'{update_sql} RETURNING {columns}', params, using=self.db
+        ))
+
+    def increment_views(self):
+        """Increments view count of messages in the queryset, returns updated messages."""
+        return self.update_returning(views=F('views') + 1)
 
 
 # Create your models here.
@@ -7,7 +54,70 @@ class Message(models.Model):
     views = models.PositiveIntegerField(default=0, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, auto_now=False, blank=True)
     updated_at = models.DateTimeField(auto_now=True, blank=True)
+    # incremented on every update of the content, backs optimistic concurrency (ETag / If-Match)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # backs keyset pagination of the messages list (newest first)
+            models.Index(fields=['-updated_at', '-id'], name='api_message_updated_id_idx'),
+            # backs most viewed messages (api/messages/top)
+            models.Index(fields=['-views', '-id'], name='api_message_views_id_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"Message {self.id}, views {self.views}," \
                f" content: {(self.content[:30] + '..') if len(self.content) > 30 else self.content}"
+
+
+class MessageChange(models.Model):
+    """Log of created, updated and deleted messages (see `api.changes`).
+    Its auto-incremented id is the cursor of `api/messages/changes`.
+    """
+    message_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"Change {self.id}: message {self.message_id} {'deleted' if self.deleted else 'saved'}"
+
+
+class ArchivedMessage(models.Model):
+    """Message moved out of `api_message` by `manage.py archive_messages` (see `api.archive`).
+    Keeps id of the message, so it is still served by `api/messages/<id>`.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    content = models.CharField(max_length=160)
+    views = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    version = models.PositiveIntegerField(default=1)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MessageQuerySet.as_manager()
+
+    def __str__(self) -> str:
+        return f"Archived message {self.id}, views {self.views}"
+
+
+class Task(models.Model):
+    """Background task stored by `TASKS_MODE = 'db'` and run by `manage.py run_worker` (see `core.tasks`)."""
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    run_at = models.DateTimeField()
+    attempts = models.PositiveIntegerField(default=0)
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # backs polling for due tasks
+            models.Index(fields=['failed', 'run_at'], name='api_task_due_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"Task {self.id}: {self.name}{' (failed)' if self.failed else ''}"
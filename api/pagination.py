@@ -0,0 +1,173 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from urllib import parse
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class PageSizeMixin:
+    """Page size from `MESSAGES_PAGE_SIZE`, clients can ask for up to `MESSAGES_MAX_PAGE_SIZE` rows."""
+    page_size_query_param = 'page_size'
+
+    @property
+    def page_size(self):
+        return settings.MESSAGES_PAGE_SIZE
+
+    @property
+    def max_page_size(self):
+        return settings.MESSAGES_MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        try:
+            return max(1, min(int(request.query_params[self.page_size_query_param]), self.max_page_size))
+        except (KeyError, ValueError):
+            return self.page_size
+
+
+class MessageCursorPagination(PageSizeMixin, CursorPagination):
+    """Keyset pagination over (updated_at, id), newest messages first.
+
+    Unlike DRF's CursorPagination, the cursor stores both the timestamp and the id
+    of the boundary row, so every page is a single index range scan
+    (see `api_message_updated_id_idx`) no matter how deep the client goes
+    and no matter how many messages share the same `updated_at`.
+
+    Pagination is only applied when the client asks for it (`cursor` or `page_size`
+    query parameter) unless `MESSAGES_PAGINATE_BY_DEFAULT` is enabled,
+    so plain `GET api/messages` keeps returning a bare array.
+    """
+    ordering = ('-updated_at', '-id')
+
+    def is_requested(self, request):
+        if settings.MESSAGES_PAGINATE_BY_DEFAULT:
+            return True
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        self.reverse = cursor is not None and cursor['reverse']
+
+        if cursor is not None:
+            updated_at, pk = cursor['position']
+            if self.reverse:
+                queryset = queryset.filter(
+                    Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk),
+                    updated_at__gte=updated_at,
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=pk),
+                    updated_at__lte=updated_at,
+                )
+
+        ordering = ('updated_at', 'id') if self.reverse else self.ordering
+        results = list(queryset.order_by(*ordering)[:page_size + 1])
+        has_more = len(results) > page_size
+        self.page = results[:page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            updated_at = parse_datetime(tokens['p'][0])
+            pk = int(tokens['i'][0])
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if updated_at is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        return {'position': (updated_at, pk), 'reverse': reverse}
+
+    def encode_cursor(self, instance, reverse=False):
+        tokens = {'p': instance.updated_at.isoformat(), 'i': str(instance.id)}
+        if reverse:
+            tokens['r'] = '1'
+        querystring = parse.urlencode(tokens)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class MessageSearchPagination(PageSizeMixin, BasePagination):
+    """Page number pagination of ranked search results (see `api.search.MessageSearch`).
+
+    Ranked results cannot be paginated by keyset, pages are fetched with LIMIT/OFFSET instead
+    (one row more than the page size, to find out if there is a next page - no COUNT query).
+    OFFSET reads all skipped rows, so pages starting after `max_offset` results are rejected with 404.
+    """
+    page_query_param = 'page'
+    max_offset = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = max(1, int(request.query_params.get(self.page_query_param, 1)))
+        except ValueError:
+            raise NotFound('Invalid page.')
+
+        offset = (self.page_number - 1) * page_size
+        if offset > self.max_offset:
+            raise NotFound('Invalid page.')
+        results = queryset[offset:offset + page_size + 1]
+        self.has_next = len(results) > page_size
+        return results[:page_size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number == 1:
+            return None
+        if self.page_number == 2:
+            return remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(self.base_url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,62 @@
+"""Ranked full-text search over message content.
+
+Backed by the indexes created in migration `0004_message_search`:
+    postgresql - GIN index on `to_tsvector('simple', content)`, ranked with `ts_rank`
+    sqlite     - FTS5 table `api_message_fts` kept in sync by triggers, ranked with bm25
+Other databases fall back to (unindexed) `icontains` filter, newest messages first.
+
+All words of the query have to be present in the message (in any order, case-insensitive).
+"""
+import re
+
+from django.db import connections
+
+from api.models import Message
+
+WORD_RE = re.compile(r'\w+')
+
+
+def search_words(query):
+    """Returns words of user's query (operators and punctuation are not interpreted)."""
+    return WORD_RE.findall(query.lower())
+
+
+class MessageSearch:
+    """Search results of `query`, every slice of them is fetched with one LIMIT/OFFSET query."""
+
+    def __init__(self, query, using='default'):
+        self.words = search_words(query)
+        self.using = using
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None or key.start is None or key.stop is None:
+            raise TypeError('MessageSearch supports only slices with start and stop.')
+        limit, offset = max(0, key.stop - key.start), key.start
+        if not self.words or not limit:
+            return []
+
+        vendor = connections[self.using].vendor
+        if vendor == 'postgresql':
+            return self._raw(
+                'SELECT m.* FROM api_message m '
+                "WHERE to_tsvector('simple', m.content) @@ plainto_tsquery('simple', %s) "
+                "ORDER BY ts_rank(to_tsvector('simple', m.content), plainto_tsquery('simple', %s)) DESC, m.id DESC "
+                'LIMIT %s OFFSET %s',
+                [' '.join(self.words)] * 2 + [limit, offset],
+            )
+        if vendor == 'sqlite':
+            # every word quoted, so that it is matched as a string and not parsed as FTS5 syntax
+            match = ' '.join(f'"{word}"' for word in self.words)
+            return self._raw(
+                'SELECT m.* FROM api_message_fts f JOIN api_message m ON m.id = f.rowid '
+                'WHERE api_message_fts MATCH %s ORDER BY f.rank, m.id DESC LIMIT %s OFFSET %s',
+                [match, limit, offset],
+            )
+
+        queryset = Message.objects.using(self.using)
+        for word in self.words:
+            queryset = queryset.filter(content__icontains=word)
+        return list(queryset.order_by('-updated_at', '-id')[offset:offset + limit])
+
+    def _raw(self, query, params):
+        return list(Message.objects.raw(query, params, using=self.using))
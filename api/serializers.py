@@ -1,19 +1,197 @@
+import datetime
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from api.models import Message
+from api.search import search_words
+from core.metrics import timed
+
+MESSAGE_FIELDS = ('id', 'content', 'views', 'created_at', 'updated_at')
+DATETIME_FIELDS = ('created_at', 'updated_at')
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        """Inserts all messages with bulk_create, `MESSAGES_BULK_BATCH_SIZE` rows per INSERT.
+        SQLite does not return ids from bulk inserts, but it locks the database for writes with the first INSERT,
+        so the created messages are the last ones by id and their ids are read back.
+        On other databases which do not return them ids stay None (other sessions may insert meanwhile).
+        """
+        messages = [Message(content=item['content']) for item in validated_data]
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=settings.MESSAGES_BULK_BATCH_SIZE)
+            if messages and messages[0].pk is None and connections[Message.objects.db].vendor == 'sqlite':
+                ids = list(Message.objects.order_by('-id').values_list('id', flat=True)[:len(messages)])
+                for message, pk in zip(messages, reversed(ids)):
+                    message.pk = pk
+        return messages
+
+    @timed('serialize')
+    def to_representation(self, data):
+        return super().to_representation(data)
 
 
 class MessageSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField()
-    created_at = serializers.DateTimeField("%Y-%m-%d %H:%M:%S", required=False, read_only=True)
-    updated_at = serializers.DateTimeField("%Y-%m-%d %H:%M:%S", required=False, read_only=True)
+    created_at = serializers.DateTimeField(DATETIME_FORMAT, required=False, read_only=True)
+    updated_at = serializers.DateTimeField(DATETIME_FORMAT, required=False, read_only=True)
 
     class Meta:
         model = Message
-        fields = ['id', 'content', 'views', 'created_at', 'updated_at']
+        fields = list(MESSAGE_FIELDS)
+        list_serializer_class = MessageListSerializer
+
+    @timed('serialize')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
 
     def create(self, validated_data):
         message = Message.objects.create(
             content=validated_data['content']
         )
         return message
+
+
+class BulkDeleteMessagesSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+
+    def validate_ids(self, ids):
+        if len(ids) > settings.MESSAGES_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(f"Ensure there are no more than {settings.MESSAGES_BULK_MAX_ITEMS} ids.")
+        return ids
+
+
+class ExportMessagesSerializer(serializers.Serializer):
+    updated_since = serializers.DateTimeField(required=False)
+    updated_until = serializers.DateTimeField(required=False)
+
+
+class SearchMessagesSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+
+    def validate_q(self, q):
+        if not search_words(q):
+            raise serializers.ValidationError('Query must contain at least one word.')
+        return q
+
+
+class TopMessagesSerializer(serializers.Serializer):
+    n = serializers.IntegerField(min_value=1, default=10)
+
+    def validate_n(self, n):
+        if n > settings.MESSAGES_TOP_SIZE:
+            raise serializers.ValidationError(
+                f'Ensure this value is less than or equal to {settings.MESSAGES_TOP_SIZE}.'
+            )
+        return n
+
+
+class MessageChangesSerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, required=False)
+    wait = serializers.FloatField(min_value=0, default=0)
+
+    def validate_limit(self, limit):
+        return min(limit, settings.MESSAGES_CHANGES_PAGE_SIZE)
+
+    def validate_wait(self, wait):
+        if wait > settings.MESSAGES_CHANGES_MAX_WAIT:
+            raise serializers.ValidationError(
+                f'Ensure this value is less than or equal to {settings.MESSAGES_CHANGES_MAX_WAIT}.'
+            )
+        return wait
+
+    def validate(self, attrs):
+        attrs.setdefault('limit', settings.MESSAGES_CHANGES_PAGE_SIZE)
+        return attrs
+
+
+class ListMessagesSerializer(serializers.Serializer):
+    fields = serializers.CharField(required=False)
+    layout = serializers.ChoiceField(choices=['rows', 'columns'], default='rows')
+
+    def validate_fields(self, fields):
+        """Returns tuple of comma separated field names (in requested order, without duplicates)."""
+        names = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+        unknown = [name for name in names if name not in MESSAGE_FIELDS]
+        if not names or unknown:
+            raise serializers.ValidationError(f"Choose fields from: {', '.join(MESSAGE_FIELDS)}.")
+        return names
+
+    def validate(self, attrs):
+        attrs.setdefault('fields', MESSAGE_FIELDS)
+        return attrs
+
+
+def datetime_formatter():
+    """Returns function formatting datetimes the same way as `MessageSerializer` (in current timezone)."""
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    formatted = {}
+
+    def format_datetime(value):
+        if tz is None:
+            return value.strftime(DATETIME_FORMAT)
+        # format is accurate to a second, so memoize by UTC second - created_at and updated_at
+        # of a message and rows inserted together usually share it
+        second = value.timestamp() // 1
+        text = formatted.get(second)
+        if text is None:
+            if len(formatted) > 4096:
+                formatted.clear()
+            local = datetime.datetime.fromtimestamp(second, tz)
+            text = formatted[second] = '%04d-%02d-%02d %02d:%02d:%02d' % (
+                local.year, local.month, local.day, local.hour, local.minute, local.second,
+            )
+        return text
+
+    return format_datetime
+
+
+def iter_serialized_messages(rows, fields=MESSAGE_FIELDS):
+    """Fast read-only path of `MessageSerializer`, yields the same data for every row
+    (only given `fields` of it, which is how `?fields=` of the messages list is served).
+    Rows can be messages or named tuples from `values_list(*MESSAGE_FIELDS, named=True)`,
+    which skips model instantiation. Datetimes are converted to current timezone
+    and formatted without going through DRF fields.
+    """
+    format_datetime = datetime_formatter()
+    if fields != MESSAGE_FIELDS:
+        for row in rows:
+            yield {
+                field: format_datetime(getattr(row, field)) if field in DATETIME_FIELDS else getattr(row, field)
+                for field in fields
+            }
+        return
+
+    for row in rows:
+        yield {
+            'id': row.id,
+            'content': row.content,
+            'views': row.views,
+            'created_at': format_datetime(row.created_at),
+            'updated_at': format_datetime(row.updated_at),
+        }
+
+
+@timed('serialize')
+def serialize_messages(rows, fields=MESSAGE_FIELDS):
+    """Returns list of serialized messages, see `iter_serialized_messages`."""
+    return list(iter_serialized_messages(rows, fields))
+
+
+@timed('serialize')
+def serialize_message_columns(rows, fields=MESSAGE_FIELDS):
+    """Returns serialized messages as parallel arrays, one per field: {field: [value of every row]}.
+    Field names are not repeated for every row, which makes big lists much smaller.
+    """
+    rows = list(rows)
+    format_datetime = datetime_formatter()
+    return {
+        field: [format_datetime(getattr(row, field)) for row in rows] if field in DATETIME_FIELDS
+        else [getattr(row, field) for row in rows]
+        for field in fields
+    }
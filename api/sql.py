@@ -0,0 +1,27 @@
+"""Raw SQL shared by migrations which have to recreate database objects of earlier migrations.
+
+SQLite adds and alters columns by rebuilding the table, which drops its triggers,
+so migrations changing `api_message` recreate the FTS5 triggers of `0004_message_search` afterwards.
+"""
+
+# keep FTS5 table in sync with api_message (same as in 0004_message_search)
+SQLITE_SEARCH_TRIGGERS = [
+    'CREATE TRIGGER api_message_fts_insert AFTER INSERT ON api_message BEGIN '
+    'INSERT INTO api_message_fts (rowid, content) VALUES (new.id, new.content); '
+    'END',
+    'CREATE TRIGGER api_message_fts_delete AFTER DELETE ON api_message BEGIN '
+    "INSERT INTO api_message_fts (api_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    'END',
+    'CREATE TRIGGER api_message_fts_update AFTER UPDATE OF content ON api_message BEGIN '
+    "INSERT INTO api_message_fts (api_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    'INSERT INTO api_message_fts (rowid, content) VALUES (new.id, new.content); '
+    'END',
+]
+
+
+def run_statements(statements):
+    """Returns RunPython function executing `statements[vendor]` on the migrated database."""
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+    return run
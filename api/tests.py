@@ -1,19 +1,69 @@
+import asyncio
+import datetime
+import json
+import os
 import random
 import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.exceptions import ObjectDoesNotExist
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed, ObjectDoesNotExist
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
 from rest_framework.status import (
-    HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT,
+    HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED,
     HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED,
-    HTTP_404_NOT_FOUND, HTTP_405_METHOD_NOT_ALLOWED,
+    HTTP_404_NOT_FOUND, HTTP_405_METHOD_NOT_ALLOWED, HTTP_412_PRECONDITION_FAILED, HTTP_428_PRECONDITION_REQUIRED,
+    HTTP_429_TOO_MANY_REQUESTS, HTTP_501_NOT_IMPLEMENTED,
 )
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
+from rest_framework.utils.serializer_helpers import ReturnList
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from api.models import Message
-from api.serializers import MessageSerializer
+from api.coalescing import SingleFlight
+from api.counters import get_view_counter
+from api.leaderboard import query_top_messages, update_leaderboard
+from api.models import ArchivedMessage, Message, MessageQuerySet, Task, supports_update_returning
+from api.serializers import MESSAGE_FIELDS, MessageSerializer, serialize_messages
+from api.views import GetUpdateDeleteMessageAPIView
+from benchmarks import api as benchmark_api
+from benchmarks import utils as benchmark_utils
+from core import tasks
+from core.metrics import registry
+from core.middleware import DatabaseHealthCheckMiddleware, ReplicaPinMiddleware
+from core.renderers import FastJSONParser, FastJSONRenderer, orjson
+from core.routers import ReplicaRouter, replica_reads
+
+task_calls = []
+
+
+@tasks.task
+def record_call(value, fail_times=0):
+    task_calls.append(value)
+    if task_calls.count(value) <= fail_times:
+        raise ValueError(value)
 
 
 class APIViewsTests(TestCase):
@@ -72,12 +122,379 @@ class APIViewsTests(TestCase):
         self.assertEqual(response.status_code, HTTP_200_OK)
         self.assertEqual(len(response.json()), 3)
 
+    def test_list_paginated(self):
+        Message.objects.bulk_create([Message(content=f'message{i}') for i in range(5)])
+        Message.objects.update(updated_at=timezone.now())  # ties are broken by id
+        expected = list(Message.objects.order_by('-updated_at', '-id').values_list('id', flat=True))
+
+        url, ids, pages = f'{self.BASE_URL}/messages?page_size=2', [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            data = response.json()
+            pages.append(data)
+            ids += [message['id'] for message in data['results']]
+            url = data['next']
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual(response.json()['results'], pages[1]['results'])
+
+    @override_settings(MESSAGES_MAX_PAGE_SIZE=2)
+    def test_list_page_size_capped(self):
+        Message.objects.bulk_create([Message(content=f'message{i}') for i in range(3)])
+        response = self.client.get(f'{self.BASE_URL}/messages?page_size=100')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_list_invalid_cursor(self):
+        response = self.client.get(f'{self.BASE_URL}/messages?cursor=invalid')
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+    def test_fast_serializer_matches_message_serializer(self):
+        Message.objects.bulk_create([
+            Message(content='plain'),
+            Message(content='zażółć gęślą jaźń \u2028 "quoted" 😀'),
+            Message(content='x' * 160, views=12345),
+        ])
+        # winter and summer time in Europe/Warsaw, around midnight UTC
+        Message.objects.filter(content='plain').update(
+            created_at=datetime.datetime(2021, 1, 31, 23, 30, 59, 999999, tzinfo=datetime.timezone.utc),
+            updated_at=datetime.datetime(2021, 7, 31, 22, 0, 0, tzinfo=datetime.timezone.utc),
+        )
+        queryset = Message.objects.order_by('id')
+        expected = JSONRenderer().render(MessageSerializer(queryset, many=True).data)
+        self.assertEqual(JSONRenderer().render(serialize_messages(queryset)), expected)
+        rows = queryset.values_list(*MESSAGE_FIELDS, named=True)
+        self.assertEqual(JSONRenderer().render(serialize_messages(rows)), expected)
+
+        response = self.client.get(f'{self.BASE_URL}/messages')
+        self.assertEqual(response.json(), json.loads(JSONRenderer().render(
+            MessageSerializer(queryset.order_by('-updated_at', '-id'), many=True).data
+        )))
+
+    def test_list_fields(self):
+        Message.objects.bulk_create([Message(content=f'message{i}', views=i) for i in range(3)])
+        full = self.client.get(f'{self.BASE_URL}/messages').json()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'{self.BASE_URL}/messages?fields=views,id,views')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json(), [{'views': m['views'], 'id': m['id']} for m in full])
+        self.assertNotIn('"content"', queries[-1]['sql'])
+
+        response = self.client.get(f'{self.BASE_URL}/messages?fields=content,created_at&layout=columns')
+        self.assertEqual(response.json(), {
+            'content': [m['content'] for m in full], 'created_at': [m['created_at'] for m in full],
+        })
+        self.assertEqual(self.client.get(f'{self.BASE_URL}/messages?layout=columns').json()['id'],
+                         [m['id'] for m in full])
+
+        for params in ['fields=,', 'fields=id,password', 'layout=table']:
+            response = self.client.get(f'{self.BASE_URL}/messages?{params}')
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST, params)
+
+    def test_list_fields_paginated(self):
+        Message.objects.bulk_create([Message(content=f'message{i}') for i in range(5)])
+        expected = list(Message.objects.order_by('-updated_at', '-id').values_list('views', flat=True))
+        url, views = f'{self.BASE_URL}/messages?page_size=2&fields=views&layout=columns', []
+        while url:
+            data = self.client.get(url).json()
+            self.assertEqual(list(data['results']), ['views'])
+            views += data['results']['views']
+            url = data['next']
+        self.assertEqual(views, expected)
+
     def test_create_new_message(self):
         response = self.client.post(f'{self.BASE_URL}/messages', data={
             'content': 'Test message'
         }, **self.bearer_token)
         self.assertEqual(response.status_code, HTTP_201_CREATED)
 
+    def test_bulk_create_messages(self):
+        contents = [f'message{i}' for i in range(10)]
+        with override_settings(MESSAGES_BULK_BATCH_SIZE=5):
+            response = self.client.post(f'{self.BASE_URL}/messages/bulk', data=contents,
+                                        format='json', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual([message['content'] for message in response.json()], contents)
+        self.assertEqual(
+            [(message['id'], message['content']) for message in response.json()],
+            list(Message.objects.order_by('id').values_list('id', 'content')),
+        )
+
+        # ids are only read back where no other session can insert meanwhile
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            response = self.client.post(f'{self.BASE_URL}/messages/bulk', data=['other'],
+                                        format='json', **self.bearer_token)
+        self.assertEqual(response.json()[0]['id'], None if not connection.features.can_return_rows_from_bulk_insert
+                         else Message.objects.get(content='other').id)
+
+    def test_bulk_create_invalid_message(self):
+        response = self.client.post(f'{self.BASE_URL}/messages/bulk', data=[
+            'valid', {'content': ''}, {'content': 'x' * 161},
+        ], format='json', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertIn('content', errors[1])
+        self.assertIn('content', errors[2])
+        self.assertEqual(Message.objects.count(), 0)
+
+        response = self.client.post(f'{self.BASE_URL}/messages/bulk', data={'content': 'not a list'},
+                                    format='json', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(f'{self.BASE_URL}/messages/bulk', data=['message'], format='json')
+        self.assertEqual(response.status_code, HTTP_401_UNAUTHORIZED)
+
+    def test_bulk_delete_messages(self):
+        Message.objects.bulk_create([Message(content=f'message{i}') for i in range(3)])
+        ids = list(Message.objects.order_by('id').values_list('id', flat=True))
+        response = self.client.delete(f'{self.BASE_URL}/messages/bulk', data={
+            'ids': ids[:2] + [ids[-1] + 1],
+        }, format='json', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json(), {'deleted': ids[:2], 'not_found': [ids[-1] + 1]})
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), ids[2:])
+
+        response = self.client.delete(f'{self.BASE_URL}/messages/bulk', data={'ids': []},
+                                      format='json', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_export_messages(self):
+        Message.objects.bulk_create([Message(content=f'message{i}') for i in range(3)])
+        old, middle, new = Message.objects.order_by('id')
+        now = timezone.now()
+        Message.objects.filter(id=old.id).update(updated_at=now - datetime.timedelta(days=2))
+        Message.objects.filter(id=middle.id).update(updated_at=now - datetime.timedelta(days=1))
+
+        response = self.client.get(f'{self.BASE_URL}/messages/export', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        expected = [MessageSerializer(message).data for message in Message.objects.order_by('updated_at')]
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+        response = self.client.get(f'{self.BASE_URL}/messages/export', data={
+            'updated_since': (now - datetime.timedelta(days=1)).isoformat(),
+            'updated_until': (now - datetime.timedelta(hours=12)).isoformat(),
+        }, **self.bearer_token)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [middle.id])
+
+        response = self.client.get(f'{self.BASE_URL}/messages/export?updated_since=yesterday',
+                                   **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_export_messages_command(self):
+        Message.objects.bulk_create([Message(content=f'message{i}') for i in range(3)])
+        out = StringIO()
+        call_command('export_messages', '--chunk-size=2', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([json.loads(line)['content'] for line in lines], ['message0', 'message1', 'message2'])
+
+    def test_search_messages(self):
+        Message.objects.bulk_create([Message(content=c) for c in [
+            'Cats and dogs', 'A long story about a cat, a dog and some birds', 'Cat cat cat', 'Only birds here',
+        ]])
+        long_story, cats = Message.objects.get(content__startswith='A long'), Message.objects.get(content='Cat cat cat')
+
+        response = self.client.get(f'{self.BASE_URL}/messages/search', data={'q': 'cat'})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0], MessageSerializer(cats).data)
+        self.assertEqual({m['id'] for m in response.json()['results']}, {long_story.id, cats.id})
+
+        response = self.client.get(f'{self.BASE_URL}/messages/search', data={'q': 'BIRDS story'})
+        self.assertEqual([m['id'] for m in response.json()['results']], [long_story.id])
+
+        # search index follows updates and deletes
+        self.client.put(f'{self.BASE_URL}/messages/{cats.id}', data={'content': 'No more'}, **self.bearer_token)
+        self.client.delete(f'{self.BASE_URL}/messages/{long_story.id}', **self.bearer_token)
+        response = self.client.get(f'{self.BASE_URL}/messages/search', data={'q': 'cat'})
+        self.assertEqual(response.json()['results'], [])
+        response = self.client.get(f'{self.BASE_URL}/messages/search', data={'q': 'more'})
+        self.assertEqual([m['id'] for m in response.json()['results']], [cats.id])
+
+    def test_search_messages_paginated(self):
+        Message.objects.bulk_create([Message(content=f'search {i}') for i in range(5)])
+        url, ids = f'{self.BASE_URL}/messages/search?q=search&page_size=2', []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(m['id'] for m in data['results'])
+            url = data['next']
+        self.assertEqual(sorted(ids), sorted(Message.objects.values_list('id', flat=True)))
+
+        data = self.client.get(f'{self.BASE_URL}/messages/search?q=search&page_size=2&page=3').json()
+        self.assertEqual((len(data['results']), data['next']), (1, None))
+        self.assertIn('page=2', data['previous'])
+
+        for page in ['99999999999999999999', '5002', 'x']:
+            response = self.client.get(f'{self.BASE_URL}/messages/search', data={'q': 'search', 'page': page})
+            self.assertEqual(response.status_code, HTTP_404_NOT_FOUND, page)
+
+    def test_search_messages_invalid_query(self):
+        for params in [{}, {'q': ''}, {'q': '"*) -'}]:
+            response = self.client.get(f'{self.BASE_URL}/messages/search', data=params)
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        response = self.client.get(f'{self.BASE_URL}/messages/search', data={'q': '"cat" OR NEAR(dog'})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_top_messages(self):
+        Message.objects.bulk_create([
+            Message(content=f'message{i}', views=views) for i, views in enumerate([3, 7, 3, 1])
+        ])
+        response = self.client.get(f'{self.BASE_URL}/messages/top', data={'n': 3})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual([(m['content'], m['views']) for m in response.json()],
+                         [('message1', 7), ('message2', 3), ('message0', 3)])
+        self.assertEqual(len(self.client.get(f'{self.BASE_URL}/messages/top').json()), 4)
+
+        for n in [0, 101, 'x']:
+            response = self.client.get(f'{self.BASE_URL}/messages/top', data={'n': n})
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_archived_messages(self):
+        old = Message.objects.create(content='old')
+        new = Message.objects.create(content='new')
+        Message.objects.filter(id=old.id).update(views=3, updated_at=timezone.now() - datetime.timedelta(days=400))
+        cursor = self.get_changes()['cursor']
+        out = StringIO()
+        call_command('archive_messages', '--older-than', '365', '--batch-size', '1', stdout=out)
+        self.assertIn('Archived 1 messages', out.getvalue())
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), [new.id])
+        self.assertEqual(ArchivedMessage.objects.get().content, 'old')
+        # archiving is not a change
+        self.assertEqual(self.get_changes(since=cursor)['deleted'], [])
+
+        response = self.client.get(f'{self.BASE_URL}/messages/{old.id}')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual((response.json()['content'], response.json()['views']), ('old', 4))
+        self.assertEqual(self.client.get(f'{self.BASE_URL}/messages',
+                                         data={'fields': 'id'}).json(), [{'id': new.id}])
+        response = self.client.get(f'{self.BASE_URL}/messages/{old.id}', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+        # updates and deletes move the message back to the hot table
+        response = self.client.put(f'{self.BASE_URL}/messages/{old.id}', data={'content': ''}, **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        response = self.client.put(f'{self.BASE_URL}/messages/{old.id}', data={'content': 'updated'},
+                                   **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()['content'], 'updated')
+        self.assertFalse(ArchivedMessage.objects.exists())
+        self.assertEqual(self.get_changes(since=cursor)['messages'][0]['content'], 'updated')
+
+        call_command('archive_messages', '--older-than', '0', stdout=StringIO())
+        response = self.client.delete(f'{self.BASE_URL}/messages/{new.id}', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_204_NO_CONTENT)
+        self.assertEqual(list(ArchivedMessage.objects.values_list('id', flat=True)), [old.id])
+        self.assertEqual(self.client.get(f'{self.BASE_URL}/messages/{new.id}').status_code, HTTP_404_NOT_FOUND)
+        self.assertIn(new.id, self.get_changes(since=cursor)['deleted'])
+
+        # a sync from scratch gets archived messages as well
+        changes = self.get_changes(since=0)
+        self.assertEqual(([message['id'] for message in changes['messages']], changes['deleted']), ([old.id], [new.id]))
+
+        response = self.client.delete(f'{self.BASE_URL}/messages/bulk', data={'ids': [old.id, new.id]},
+                                      format='json', **self.bearer_token)
+        self.assertEqual(response.json(), {'deleted': [old.id], 'not_found': [new.id]})
+        self.assertFalse(ArchivedMessage.objects.exists())
+        self.assertEqual(self.get_changes(since=0)['deleted'], [new.id, old.id])
+
+    def get_changes(self, **params):
+        response = self.client.get(f'{self.BASE_URL}/messages/changes', data=params, **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return response.json()
+
+    def test_message_changes(self):
+        cursor = self.get_changes()['cursor']
+        first = self.client.post(f'{self.BASE_URL}/messages', data={'content': 'first'}, **self.bearer_token).json()
+        second = self.client.post(f'{self.BASE_URL}/messages', data={'content': 'second'}, **self.bearer_token).json()
+        changes = self.get_changes(since=cursor)
+        self.assertEqual([message['content'] for message in changes['messages']], ['first', 'second'])
+        self.assertEqual((changes['deleted'], changes['has_more']), ([], False))
+        cursor = changes['cursor']
+        self.assertEqual(self.get_changes(since=cursor), {'cursor': cursor, 'has_more': False,
+                                                          'messages': [], 'deleted': []})
+
+        self.client.put(f'{self.BASE_URL}/messages/{first["id"]}', data={'content': 'updated'}, **self.bearer_token)
+        self.client.delete(f'{self.BASE_URL}/messages/{second["id"]}', **self.bearer_token)
+        self.client.post(f'{self.BASE_URL}/messages/bulk', data=['third', 'fourth'],
+                         format='json', **self.bearer_token)
+        fourth = Message.objects.get(content='fourth')
+        self.client.delete(f'{self.BASE_URL}/messages/bulk', data={'ids': [fourth.id]},
+                           format='json', **self.bearer_token)
+        changes = self.get_changes(since=cursor)
+        self.assertEqual([message['content'] for message in changes['messages']], ['updated', 'third'])
+        self.assertEqual(changes['deleted'], [second['id'], fourth.id])
+
+        # views are not logged, but changed messages come with current views
+        self.client.get(f'{self.BASE_URL}/messages/{first["id"]}')
+        self.assertEqual(self.get_changes(since=changes['cursor'])['messages'], [])
+        self.assertEqual(self.get_changes(since=cursor)['messages'][0]['views'], 1)
+
+    def test_message_changes_pages(self):
+        self.client.post(f'{self.BASE_URL}/messages/bulk', data=[f'message{i}' for i in range(5)],
+                         format='json', **self.bearer_token)
+        contents, cursor, has_more = [], 0, True
+        while has_more:
+            changes = self.get_changes(since=cursor, limit=2)
+            self.assertLessEqual(len(changes['messages']), 2)
+            contents += [message['content'] for message in changes['messages']]
+            cursor, has_more = changes['cursor'], changes['has_more']
+        self.assertEqual(contents, [f'message{i}' for i in range(5)])
+
+        with override_settings(MESSAGES_CHANGES_PAGE_SIZE=3):
+            self.assertEqual(len(self.get_changes(limit=100)['messages']), 3)
+
+    def test_message_changes_stop_at_horizon(self):
+        cursor = self.get_changes()['cursor']
+        first, second = Message.objects.create(content='first'), Message.objects.create(content='second')
+        # change of the second message is below the lowest ticket of a transaction in flight
+        with mock.patch('api.changes.change_horizon', return_value=cursor + 2):
+            changes = self.get_changes(since=cursor)
+        self.assertEqual([message['id'] for message in changes['messages']], [first.id])
+        self.assertEqual(changes['cursor'], cursor + 1)
+        self.assertEqual([message['id'] for message in self.get_changes(since=changes['cursor'])['messages']],
+                         [second.id])
+
+    @override_settings(MESSAGES_CHANGES_POLL_INTERVAL=0.01, MESSAGES_CHANGES_MAX_WAIT=1)
+    def test_message_changes_wait(self):
+        message = Message.objects.create(content='Test')
+        cursor = self.get_changes(wait=0.05)['cursor']
+        # changes of views are not logged
+        Message.objects.filter(id=message.id).update(views=10)
+        self.assertEqual(self.get_changes(since=cursor, wait=0.05)['messages'], [])
+        # changes made outside of the API are logged
+        Message.objects.filter(id=message.id).update(content='Updated')
+        self.assertEqual(self.get_changes(since=cursor, wait=0.05)['messages'][0]['content'], 'Updated')
+
+        for params in [{'wait': 2}, {'wait': -1}, {'since': -1}, {'limit': 0}]:
+            response = self.client.get(f'{self.BASE_URL}/messages/changes', data=params, **self.bearer_token)
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST, params)
+        response = self.client.get(f'{self.BASE_URL}/messages/changes')
+        self.assertEqual(response.status_code, HTTP_401_UNAUTHORIZED)
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_benchmark_flows(self):
+        report = benchmark_api.run(messages=10, requests=3, auth_requests=2)
+        self.assertEqual([result['flow'] for result in report['results']], list(benchmark_api.FLOWS))
+        for result in report['results']:
+            self.assertEqual(result['errors'], 0, result['flow'])
+            self.assertGreater(result['queries_per_request'], 0, result['flow'])
+        self.assertEqual(Message.objects.count(), 10)
+
+        compared = benchmark_api.compare(json.loads(json.dumps(report)), report)
+        self.assertEqual(compared['results'][0]['baseline']['p50_change_pct'], 0)
+
+    def test_benchmark_percentile(self):
+        self.assertEqual([benchmark_utils.percentile([1, 2, 3, 4, 5], percent) for percent in (1, 50, 95, 100)],
+                         [1, 3, 5, 5])
+        self.assertEqual(benchmark_utils.percentile([4, 1, 3, 2], 50), 2)
+
     def test_create_empty_message(self):
         response = self.client.post(f'{self.BASE_URL}/messages', data={
             'content': ''
@@ -124,6 +541,97 @@ class APIViewsTests(TestCase):
         self.assertEqual(response.json(), MessageSerializer(message).data)
         self.assertEqual(message.views, 1)
 
+    @unittest.skipUnless(supports_update_returning(connection), 'database does not support UPDATE ... RETURNING')
+    def test_get_message_single_query(self):
+        message = Message.objects.create(content='Test')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()['views'], 1)
+
+        # a miss is looked up in the archive as well
+        with self.assertNumQueries(2):
+            response = self.client.get(f'{self.BASE_URL}/messages/{message.id + 1}')
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+    def test_list_conditional_get(self):
+        Message.objects.create(content='message1')
+        response = self.client.get(f'{self.BASE_URL}/messages')
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'{self.BASE_URL}/messages', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        # different page has different validator
+        response = self.client.get(f'{self.BASE_URL}/messages?page_size=1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        message = Message.objects.create(content='message2')
+        response = self.client.get(f'{self.BASE_URL}/messages', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        etag = response['ETag']
+
+        message.delete()
+        response = self.client.get(f'{self.BASE_URL}/messages', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_list_page_conditional_get(self):
+        for i in range(3):
+            Message.objects.create(content=f'message{i}')
+        response = self.client.get(f'{self.BASE_URL}/messages?page_size=2')
+        first, next_url = response['ETag'], response.json()['next']
+        response = self.client.get(next_url)
+        second = response['ETag']
+        self.assertNotEqual(first, second)
+
+        # validators come from the rows of the page, no aggregate over the whole table
+        with self.assertNumQueries(1):
+            response = self.client.get(f'{self.BASE_URL}/messages?page_size=2', HTTP_IF_NONE_MATCH=first)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+        Message.objects.create(content='message3')
+        response = self.client.get(f'{self.BASE_URL}/messages?page_size=2', HTTP_IF_NONE_MATCH=first)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        # the new message does not change the rows after the cursor
+        response = self.client.get(next_url, HTTP_IF_NONE_MATCH=second)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+    def test_list_conditional_get_with_views(self):
+        message = Message.objects.create(content='message1')
+        with_views = self.client.get(f'{self.BASE_URL}/messages', data={'fields': 'id,views'})['ETag']
+        without_views = self.client.get(f'{self.BASE_URL}/messages', data={'fields': 'id,content'})['ETag']
+        self.assertTrue(with_views.startswith('W/"'))
+
+        self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+        response = self.client.get(f'{self.BASE_URL}/messages', data={'fields': 'id,views'},
+                                   HTTP_IF_NONE_MATCH=with_views)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json(), [{'id': message.id, 'views': 1}])
+        response = self.client.get(f'{self.BASE_URL}/messages', data={'fields': 'id,content'},
+                                   HTTP_IF_NONE_MATCH=without_views)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+    def test_get_message_conditional_get(self):
+        message = Message.objects.create(content='Test')
+        response = self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        response = self.client.get(f'{self.BASE_URL}/messages/{message.id}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        response = self.client.get(f'{self.BASE_URL}/messages/{message.id}', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        message.refresh_from_db()
+        self.assertEqual(message.views, 3)  # 304 counts as a view
+
+        self.client.put(f'{self.BASE_URL}/messages/{message.id}', data={'content': 'Updated'}, **self.bearer_token)
+        response = self.client.get(f'{self.BASE_URL}/messages/{message.id}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()['content'], 'Updated')
+
     def test_update_message(self):
         message = Message.objects.create(content='Test message', views=1)
         self.assertEqual(message.content, 'Test message')
@@ -136,6 +644,57 @@ class APIViewsTests(TestCase):
         self.assertEqual(response.json()['views'], 0)
         self.assertEqual(message.views, 0)
 
+    def test_update_message_if_match(self):
+        message = Message.objects.create(content='Test message')
+        url = f'{self.BASE_URL}/messages/{message.id}'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(etag, f'"{message.id}-v1"')
+
+        response = self.client.put(url, data={'content': 'First'}, HTTP_IF_MATCH=etag, **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response['ETag'], f'"{message.id}-v2"')
+        self.assertEqual(self.client.get(url)['ETag'], response['ETag'])
+
+        # the other client still has the first version
+        response = self.client.put(url, data={'content': 'Second'}, HTTP_IF_MATCH=etag, **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response['ETag'], f'"{message.id}-v2"')
+        response = self.client.put(url, data={'content': 'Second'}, HTTP_IF_MATCH=f'W/"{message.id}-v2"',
+                                   **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_412_PRECONDITION_FAILED)
+        message.refresh_from_db()
+        self.assertEqual((message.content, message.version), ('First', 2))
+
+        response = self.client.put(url, data={'content': 'Second'}, HTTP_IF_MATCH=f'"0-v1", "{message.id}-v2"',
+                                   **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        response = self.client.put(url, data={'content': 'Third'}, HTTP_IF_MATCH='*', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response['ETag'], f'"{message.id}-v4"')
+
+        response = self.client.put(f'{self.BASE_URL}/messages/{message.id + 1}', data={'content': 'Test'},
+                                   HTTP_IF_MATCH=etag, **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+    @unittest.skipUnless(supports_update_returning(connection), 'UPDATE ... RETURNING is not supported')
+    def test_update_message_single_query(self):
+        message = Message.objects.create(content='Test message')
+        token = self.bearer_token
+        self.client.get(f'{self.BASE_URL}/messages/{message.id}', **token)  # authenticated user is cached
+        with self.assertNumQueries(1):
+            response = self.client.put(f'{self.BASE_URL}/messages/{message.id}', data={'content': 'Updated'},
+                                       HTTP_IF_MATCH=f'"{message.id}-v1"', **token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+    @override_settings(MESSAGES_REQUIRE_IF_MATCH=True)
+    def test_update_message_if_match_required(self):
+        message = Message.objects.create(content='Test message')
+        url = f'{self.BASE_URL}/messages/{message.id}'
+        response = self.client.put(url, data={'content': 'Updated'}, **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_428_PRECONDITION_REQUIRED)
+        response = self.client.put(url, data={'content': 'Updated'}, HTTP_IF_MATCH='*', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
     def test_update_message_same_content(self):
         message = Message.objects.create(content='Test message', views=1)
         self.assertEqual(message.content, 'Test message')
@@ -187,3 +746,687 @@ class APIViewsTests(TestCase):
 
         response = self.client.delete(f'{self.BASE_URL}/messages/', **self.bearer_token)
         self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+
+@override_settings(ROOT_URLCONF='core.asgi_urls', MESSAGES_ASYNC_THREADS=0)
+class AsyncAPIViewsTests(APIViewsTests):
+    """Runs all API tests against async views used by ASGI deployments."""
+
+    def test_async_views_resolved(self):
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/api/messages').func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/api/messages/1').func))
+
+    def test_export_messages(self):
+        # streaming responses are iterated in the event loop, where the export queries are not allowed
+        response = async_to_sync(AsyncClient().get)('/api/messages/export', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_501_NOT_IMPLEMENTED)
+        self.assertIn('export_messages', response.json()['detail'])
+
+
+@override_settings(
+    ROOT_URLCONF='core.asgi_urls', MESSAGES_ASYNC_THREADS=2, METRICS_ENABLED=True, DB_HEALTH_CHECK_INTERVAL=30,
+)
+class AsyncThreadPoolViewsTests(TransactionTestCase):
+    def test_concurrent_requests_in_thread_pool(self):
+        message = Message.objects.create(content='Test')
+        client = AsyncClient()
+        retrieve = GetUpdateDeleteMessageAPIView.retrieve
+        lock = threading.Lock()
+        running, overlap = [0], [0]
+
+        def slow_retrieve(view, request, *args, **kwargs):
+            with lock:
+                running[0] += 1
+                overlap[0] = max(overlap[0], running[0])
+            time.sleep(0.1)
+            with lock:
+                running[0] -= 1
+                # in-memory SQLite test database does not take concurrent writes (table is locked)
+                return retrieve(view, request, *args, **kwargs)
+
+        async def get_concurrently():
+            return await asyncio.gather(*[client.get(f'/api/messages/{message.id}') for _ in range(5)])
+
+        with mock.patch.object(GetUpdateDeleteMessageAPIView, 'retrieve', slow_retrieve):
+            responses = async_to_sync(get_concurrently)()
+        self.assertEqual([response.status_code for response in responses], [HTTP_200_OK] * 5)
+        self.assertEqual(sorted(response.json()['views'] for response in responses), [1, 2, 3, 4, 5])
+        self.assertIn('Server-Timing', responses[0])
+        # no sync middleware serializes the requests, both threads of the pool are busy at once
+        self.assertEqual(overlap[0], 2)
+
+
+@override_settings(MESSAGES_VIEW_COUNTER='local', MESSAGES_VIEW_FLUSH_INTERVAL=3600, MESSAGES_VIEW_FLUSH_THRESHOLD=3)
+class BufferedViewCounterTests(TestCase):
+    BASE_URL = 'http://127.0.0.1:8000/api'
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.counter = get_view_counter()
+        self.counter.flush()
+
+    def tearDown(self) -> None:
+        self.counter.flush()
+
+    def test_views_flushed_at_threshold(self):
+        message = Message.objects.create(content='Test')
+        for expected_views in (1, 2):
+            response = self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            self.assertEqual(response.json()['views'], expected_views)
+        message.refresh_from_db()
+        self.assertEqual(message.views, 0)
+
+        response = self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+        self.assertEqual(response.json()['views'], 3)
+        message.refresh_from_db()
+        self.assertEqual(message.views, 3)
+
+    def test_update_discards_buffered_views(self):
+        message = Message.objects.create(content='Test')
+        self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+        user = User.objects.create(username='test', password='testing123')
+        token = RefreshToken.for_user(user).access_token
+        self.client.put(f'{self.BASE_URL}/messages/{message.id}', data={
+            'content': 'Updated'
+        }, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.counter.flush(), {})
+        message.refresh_from_db()
+        self.assertEqual(message.views, 0)
+
+    def test_flush_views_command(self):
+        message = Message.objects.create(content='Test')
+        self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+        out = StringIO()
+        call_command('flush_views', stdout=out)
+        self.assertIn('Flushed 1 views of 1 messages', out.getvalue())
+        message.refresh_from_db()
+        self.assertEqual(message.views, 1)
+
+    def test_sqlite_view_counter(self):
+        message = Message.objects.create(content='Test')
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/views.sqlite3'
+            with override_settings(MESSAGES_VIEW_COUNTER='sqlite', MESSAGES_VIEW_COUNTER_PATH=path):
+                response = self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+                self.assertEqual(response.json()['views'], 1)
+                response = self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+                self.assertEqual(response.json()['views'], 2)
+                call_command('flush_views', stdout=StringIO())
+        message.refresh_from_db()
+        self.assertEqual(message.views, 2)
+
+
+@override_settings(MESSAGES_VIEW_COUNTER='local', MESSAGES_VIEW_FLUSH_INTERVAL=0.05, MESSAGES_VIEW_FLUSH_THRESHOLD=100)
+class ViewCounterTimerTests(TransactionTestCase):
+    def test_views_flushed_after_interval_without_traffic(self):
+        message = Message.objects.create(content='Test')
+        counter = get_view_counter()
+        counter.flush()
+        self.assertEqual(APIClient().get(f'/api/messages/{message.id}').json()['views'], 1)
+        for _ in range(100):
+            message.refresh_from_db()
+            if message.views:
+                break
+            time.sleep(0.01)
+        self.assertEqual(message.views, 1)
+        self.assertEqual(counter.incr(message.id), 1)
+        counter.flush()
+
+
+@override_settings(MESSAGES_COALESCE_READS=True)
+class CoalescedReadsTests(TransactionTestCase):
+    def test_single_flight(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'message'
+
+        def read():
+            results.append(flight.do(1, fetch))
+
+        leader = threading.Thread(target=read)
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=read) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while flight._calls[1].callers < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [('message', index, 4) for index in range(4)])
+        # later calls are not coalesced with the finished one
+        self.assertEqual(flight.do(1, lambda: 'again'), ('again', 0, 1))
+        with self.assertRaises(ValueError):
+            flight.do(1, lambda: int('x'))
+
+    def test_concurrent_reads_share_fetch(self):
+        message = Message.objects.create(content='Test')
+        increment_views = MessageQuerySet.increment_views
+        calls = []
+
+        def slow_increment_views(queryset):
+            calls.append(1)
+            time.sleep(0.2)
+            return increment_views(queryset)
+
+        responses = []
+
+        def get():
+            try:
+                responses.append(APIClient().get(f'/api/messages/{message.id}'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=get) for _ in range(5)]
+        with mock.patch.object(MessageQuerySet, 'increment_views', slow_increment_views):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual([response.status_code for response in responses], [HTTP_200_OK] * 5)
+        # every request is counted and sees its own view
+        self.assertEqual(sorted(response.json()['views'] for response in responses), [1, 2, 3, 4, 5])
+        self.assertEqual(Message.objects.get(id=message.id).views, 5)
+        self.assertLess(len(calls), 5)
+
+
+@override_settings(THROTTLE_ANON_RATE='2/min', THROTTLE_USER_RATE='3/min')
+class ThrottlingTests(TestCase):
+    def setUp(self) -> None:
+        caches[settings.THROTTLE_CACHE_ALIAS].clear()
+        self.client = APIClient()
+        self.user = User.objects.create(username='test', password='testing123')
+        self.message = Message.objects.create(content='Test')
+
+    def get(self, **extra):
+        return self.client.get(f'/api/messages/{self.message.id}', **extra)
+
+    def test_anonymous_requests_limited_per_ip(self):
+        self.assertEqual([self.get().status_code for _ in range(2)], [HTTP_200_OK] * 2)
+        response = self.get()
+        self.assertEqual(response.status_code, HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(self.get(REMOTE_ADDR='10.0.0.2').status_code, HTTP_200_OK)
+
+        # bucket refills at the rate
+        now = time.time()
+        with mock.patch('core.throttling.time.time', return_value=now + 31):
+            self.assertEqual(self.get().status_code, HTTP_200_OK)
+            self.assertEqual(self.get().status_code, HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_users_limited_per_user(self):
+        token = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        other = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        for _ in range(2):
+            self.get()
+        self.assertEqual([self.get(**token).status_code for _ in range(2)], [HTTP_200_OK] * 2)
+        # tokens of the same user share the bucket
+        self.assertEqual(self.get(**other).status_code, HTTP_200_OK)
+        self.assertEqual(self.get(**other).status_code, HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(THROTTLE_ANON_RATE='')
+    def test_disabled(self):
+        self.assertEqual({self.get().status_code for _ in range(5)}, {HTTP_200_OK})
+
+
+@override_settings(MESSAGES_CACHE_ENABLED=True)
+class MessagesCacheTests(TestCase):
+    BASE_URL = 'http://127.0.0.1:8000/api'
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        caches['messages'].clear()
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(username='test', password='testing123')
+
+    @property
+    def bearer_token(self):
+        refresh = RefreshToken.for_user(self.user)
+        return {"HTTP_AUTHORIZATION": f'Bearer {refresh.access_token}'}
+
+    def test_list_cached_until_write(self):
+        Message.objects.create(content='message1')
+        self.assertEqual(len(self.client.get(f'{self.BASE_URL}/messages').json()), 1)
+
+        Message.objects.create(content='not through API')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'{self.BASE_URL}/messages')
+        self.assertEqual(len(response.json()), 1)
+
+        self.client.post(f'{self.BASE_URL}/messages', data={'content': 'message3'}, **self.bearer_token)
+        self.assertEqual(len(self.client.get(f'{self.BASE_URL}/messages').json()), 3)
+
+        message = Message.objects.first()
+        self.client.delete(f'{self.BASE_URL}/messages/{message.id}', **self.bearer_token)
+        self.assertEqual(len(self.client.get(f'{self.BASE_URL}/messages').json()), 2)
+
+    @override_settings(MESSAGES_VIEW_COUNTER='local', MESSAGES_VIEW_FLUSH_INTERVAL=3600,
+                       MESSAGES_VIEW_FLUSH_THRESHOLD=3)
+    def test_detail_cached_with_buffered_views(self):
+        get_view_counter().flush()
+        message = Message.objects.create(content='Test')
+        self.assertEqual(self.client.get(f'{self.BASE_URL}/messages/{message.id}').json()['views'], 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+        self.assertEqual(response.json()['views'], 2)
+
+        # third view flushes the buffer and drops the cached payload
+        self.assertEqual(self.client.get(f'{self.BASE_URL}/messages/{message.id}').json()['views'], 3)
+        self.assertEqual(self.client.get(f'{self.BASE_URL}/messages/{message.id}').json()['views'], 4)
+
+        self.client.patch(f'{self.BASE_URL}/messages/{message.id}', data={'content': 'Updated'},
+                          **self.bearer_token)
+        response = self.client.get(f'{self.BASE_URL}/messages/{message.id}')
+        self.assertEqual(response.json()['content'], 'Updated')
+        self.assertEqual(response.json()['views'], 1)
+        get_view_counter().flush()
+
+    @override_settings(MESSAGES_TOP_SIZE=3)
+    def test_leaderboard_updated_incrementally(self):
+        Message.objects.bulk_create([
+            Message(content=f'message{i}', views=views) for i, views in enumerate([5, 4, 3, 2, 1])
+        ])
+        first, second, third, fourth, fifth = Message.objects.order_by('id')
+
+        def assert_top(n, queries=0):
+            expected = query_top_messages(n)
+            with self.assertNumQueries(queries):
+                response = self.client.get(f'{self.BASE_URL}/messages/top', data={'n': n})
+            self.assertEqual(response.json(), expected)
+
+        assert_top(3, queries=1)
+        assert_top(2)
+
+        # fourth message ties with third, newer message ranks higher
+        self.client.get(f'{self.BASE_URL}/messages/{fourth.id}')
+        assert_top(3)
+
+        # views of the first one are reset, it drops out and the next message is read on demand
+        self.client.put(f'{self.BASE_URL}/messages/{first.id}', data={'content': 'Updated'}, **self.bearer_token)
+        assert_top(2)
+        assert_top(3, queries=1)
+
+        self.client.delete(f'{self.BASE_URL}/messages/{second.id}', **self.bearer_token)
+        self.client.post(f'{self.BASE_URL}/messages', data={'content': 'New'}, **self.bearer_token)
+        assert_top(2)
+        assert_top(3, queries=1)
+
+    def test_leaderboard_updated_by_bulk_create(self):
+        message = Message.objects.create(content='message', views=2)
+        self.assertEqual(len(self.client.get(f'{self.BASE_URL}/messages/top').json()), 1)  # complete leaderboard
+
+        response = self.client.post(f'{self.BASE_URL}/messages/bulk', data=['a', 'b'],
+                                    format='json', **self.bearer_token)
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        with self.assertNumQueries(0):
+            response = self.client.get(f'{self.BASE_URL}/messages/top')
+        self.assertEqual([item['id'] for item in response.json()],
+                         [message.id] + sorted(Message.objects.exclude(id=message.id).values_list('id', flat=True),
+                                               reverse=True))
+
+        # rows without ids are never put into the leaderboard
+        update_leaderboard([{'id': None, 'content': 'c', 'views': 0}])
+        self.assertEqual(len(self.client.get(f'{self.BASE_URL}/messages/top').json()), 3)
+
+
+class DatabaseHealthCheckMiddlewareTests(TestCase):
+    @override_settings(DB_HEALTH_CHECK_INTERVAL=30)
+    def test_idle_unusable_connection_closed(self):
+        middleware = DatabaseHealthCheckMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get('/api/messages')
+        connection.ensure_connection()
+        middleware(request)
+        with mock.patch.object(connection, 'is_usable', return_value=False), \
+                mock.patch.object(connection, 'close') as close:
+            middleware(request)  # recently used connection is not checked
+            close.assert_not_called()
+
+            connection.health_check_last_used -= 60
+            middleware(request)
+            close.assert_called_once()
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], DATABASE_REPLICA_PIN_SECONDS=60)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Replica is an alias of the primary here (`random.choice` is patched), tests check which reads go to it."""
+
+    def setUp(self) -> None:
+        caches['default'].clear()
+        caches[settings.MESSAGES_CACHE_ALIAS].clear()
+        self.user = User.objects.create(username='test', password='testing123')
+        Message.objects.create(content='Test')
+        self.choice = mock.patch('core.routers.random.choice', return_value='default').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def list_reads_replica(self, client, **extra):
+        self.choice.reset_mock()
+        self.assertEqual(len(client.get('/api/messages', **extra).json()), Message.objects.count())
+        # one replica for all queries of the request (validators and the page)
+        self.assertLessEqual(self.choice.call_count, 1)
+        return self.choice.called
+
+    def test_router(self):
+        router = ReplicaRouter()
+        request = RequestFactory().get('/api/messages')
+        self.assertIsNone(router.db_for_read(Message))
+        self.choice.side_effect = ['default', 'replica1']
+        with replica_reads(request) as alias:
+            self.assertEqual(alias, 'default')
+            self.assertEqual(router.db_for_read(Message), 'default')
+            self.assertEqual(router.db_for_read(Message), 'default')
+            self.assertIsNone(router.db_for_read(User))
+            self.assertEqual(router.db_for_write(Message), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'api'))
+        self.assertTrue(router.allow_migrate('default', 'api'))
+
+    def test_list_reads_from_replica_until_own_write(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertTrue(self.list_reads_replica(client))
+        self.assertTrue(self.list_reads_replica(APIClient()))
+
+        self.assertEqual(client.post('/api/messages', data={'content': 'Second'}).status_code, HTTP_201_CREATED)
+        self.assertFalse(self.list_reads_replica(client))  # read your writes
+        self.assertTrue(self.list_reads_replica(APIClient(), REMOTE_ADDR='10.0.0.2'))
+
+        # failed write does not pin
+        other = APIClient()
+        other.force_authenticate(User.objects.create(username='other', password='testing123'))
+        self.assertEqual(other.post('/api/messages', data={'content': ''}).status_code, HTTP_400_BAD_REQUEST)
+        self.assertTrue(self.list_reads_replica(other))
+
+        # single messages are read from the primary
+        self.choice.reset_mock()
+        client.get(f'/api/messages/{Message.objects.first().id}')
+        self.choice.assert_not_called()
+
+    @override_settings(MESSAGES_CACHE_ENABLED=True)
+    def test_cached_pages_not_read_from_replica_after_write(self):
+        self.assertTrue(self.list_reads_replica(APIClient()))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.post('/api/messages', data={'content': 'Second'})
+        self.assertFalse(self.list_reads_replica(APIClient(), REMOTE_ADDR='10.0.0.2'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        self.assertFalse(self.list_reads_replica(APIClient()))
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaPinMiddleware(lambda request: HttpResponse())
+
+
+@override_settings(DATABASE_REPLICAS=['sqlite_replica'], DATABASE_REPLICA_PIN_SECONDS=60)
+class SQLiteReplicaTests(TransactionTestCase):
+    """Replica is a second SQLite database with different rows than the primary."""
+    ALIAS = 'sqlite_replica'
+
+    def setUp(self) -> None:
+        caches['default'].clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases[self.ALIAS] = {
+            **settings.DATABASES['default'],
+            'NAME': os.path.join(directory.name, 'replica.sqlite3'),
+            'TEST': {},
+        }
+        self.addCleanup(self.remove_replica)
+        with connections[self.ALIAS].schema_editor() as editor:
+            editor.create_model(Message)
+        Message.objects.using(self.ALIAS).create(content='replica')
+        Message.objects.create(content='primary')
+        self.user = User.objects.create(username='test', password='testing123')
+
+    def remove_replica(self):
+        connections[self.ALIAS].close()
+        del connections[self.ALIAS]
+        del connections.databases[self.ALIAS]
+
+    def list_contents(self, client, **extra):
+        return [message['content'] for message in client.get('/api/messages', **extra).json()]
+
+    def test_list_reads_replica_pinned_client_reads_primary(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(self.list_contents(client), ['replica'])
+        self.assertEqual(self.list_contents(APIClient()), ['replica'])
+
+        response = client.post('/api/messages', data={'content': 'written'})
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual(self.list_contents(client), ['written', 'primary'])
+        # other clients keep reading the (lagging) replica
+        self.assertEqual(self.list_contents(APIClient(), REMOTE_ADDR='10.0.0.2'), ['replica'])
+        self.assertEqual(self.client.get(f'/api/messages/{response.json()["id"]}').status_code, HTTP_200_OK)
+
+
+@override_settings(TASKS_RETRY_DELAY=0, TASKS_MAX_RETRIES=1)
+class BackgroundTasksTests(TestCase):
+    def setUp(self) -> None:
+        task_calls.clear()
+        registry.clear()
+
+    def test_sync_mode_runs_inline(self):
+        record_call.delay('sync')
+        self.assertEqual(task_calls, ['sync'])
+        with self.assertRaises(ValueError):
+            record_call.delay('failing', fail_times=1)
+
+    @override_settings(TASKS_MODE='thread')
+    def test_thread_mode(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_call.delay('thread', fail_times=1)
+            self.assertEqual(task_calls, [])  # not before commit
+        tasks.get_executor().submit(lambda: None).result()
+        for _ in range(100):
+            if len(task_calls) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(task_calls, ['thread', 'thread'])
+        name = record_call.name
+        self.assertEqual((registry.tasks[(name, 'retried')], registry.tasks[(name, 'succeeded')]), (1, 1))
+
+        # full queue - the task runs in the calling thread
+        with mock.patch.object(tasks._slots, 'acquire', return_value=False):
+            record_call.submit(('inline',), {})
+        self.assertEqual(task_calls[-1], 'inline')
+        self.assertEqual(registry.tasks[(name, 'inline')], 1)
+
+    @override_settings(TASKS_MODE='thread', TASKS_RETRY_DELAY=10)
+    def test_retries_scheduled_without_sleeping(self):
+        # a failed task running in the request (queue full) is retried later by a timer
+        with mock.patch.object(tasks._slots, 'acquire', return_value=False), \
+                mock.patch('core.tasks.threading.Timer') as timer:
+            start = time.monotonic()
+            record_call.submit(('inline',), {'fail_times': 1})
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(task_calls, ['inline'])
+        timer.assert_called_once_with(10, record_call.retry, (('inline',), {'fail_times': 1}, 2))
+        timer.return_value.start.assert_called_once()
+        self.assertEqual(registry.tasks[(record_call.name, 'retried')], 1)
+
+    @override_settings(TASKS_MODE='thread', MESSAGES_VIEW_COUNTER='local', MESSAGES_VIEW_FLUSH_INTERVAL=3600,
+                       MESSAGES_VIEW_FLUSH_THRESHOLD=2)
+    def test_counter_flush_not_lost_on_rollback(self):
+        counter = get_view_counter()
+        counter.flush()
+        with mock.patch.object(counter, 'flush') as flush:
+            try:
+                with transaction.atomic():
+                    counter.incr(1)
+                    counter.incr(1)
+                    raise ValueError
+            except ValueError:
+                pass
+            for _ in range(100):
+                if flush.called:
+                    break
+                time.sleep(0.01)
+        flush.assert_called_once()
+        counter.discard(1)
+        counter.flush_scheduled = False
+
+    @override_settings(TASKS_MODE='db', MESSAGES_CACHE_ENABLED=True)
+    def test_db_mode_and_worker(self):
+        caches[settings.MESSAGES_CACHE_ALIAS].clear()
+        user = User.objects.create(username='test', password='testing123')
+        client = APIClient()
+        client.force_authenticate(user)
+        self.assertEqual(client.get('/api/messages/top').json(), [])
+        message = client.post('/api/messages', data={'content': 'Test'}).json()
+        self.assertEqual(list(Task.objects.values_list('name', 'kwargs')), [('api.leaderboard.update_leaderboard', {})])
+        self.assertEqual(client.get('/api/messages/top').json(), [])
+
+        record_call.delay('db', fail_times=2)
+        out = StringIO()
+        call_command('run_worker', '--once', stdout=out)
+        self.assertIn('Processed 2 tasks', out.getvalue())
+        self.assertEqual(client.get('/api/messages/top').json(), [message])
+
+        # failed task is retried and then kept as failed
+        call_command('run_worker', '--once', stdout=StringIO())
+        failed = Task.objects.get()
+        self.assertEqual((failed.name, failed.attempts, failed.failed), (record_call.name, 2, True))
+        self.assertIn('ValueError', failed.last_error)
+        self.assertEqual(task_calls, ['db', 'db'])
+        self.assertEqual(registry.tasks[(record_call.name, 'failed')], 1)
+
+
+class InstrumentationMiddlewareTests(TestCase):
+    BASE_URL = 'http://127.0.0.1:8000'
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        registry.clear()
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create(username='test', password='testing123')
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_server_timing_and_metrics(self):
+        Message.objects.create(content='message1')
+        response = self.client.get(f'{self.BASE_URL}/api/messages')
+        self.assertRegex(response['Server-Timing'],
+                         r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="2 queries", serialize;dur=[\d.]+, auth;dur=[\d.]+$')
+
+        refresh = RefreshToken.for_user(self.user)
+        response = self.client.post(f'{self.BASE_URL}/api/messages', data={'content': 'Test'},
+                                    HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+
+        response = self.client.get(f'{self.BASE_URL}/metrics')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        metrics = response.content.decode()
+        self.assertIn('messages_api_request_duration_seconds_count{route="api/messages",method="GET"} 1', metrics)
+        self.assertIn('messages_api_db_duration_seconds_bucket{route="api/messages",method="POST",le="+Inf"} 1',
+                      metrics)
+        self.assertIn('messages_api_requests_total{route="api/messages",method="POST",status="201"} 1', metrics)
+        self.assertIn('messages_api_db_queries_total{route="api/messages",method="GET"} 2', metrics)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        response = self.client.get(f'{self.BASE_URL}/api/messages')
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('route="api/messages"', self.client.get(f'{self.BASE_URL}/metrics').content.decode())
+
+    def test_disabled(self):
+        response = self.client.get(f'{self.BASE_URL}/api/messages')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(f'{self.BASE_URL}/metrics').status_code, HTTP_404_NOT_FOUND)
+
+
+class DeploymentProfileTests(TestCase):
+    API_ONLY_SCRIPT = """
+import json
+import django
+django.setup()
+from django.conf import settings
+from django.test import Client
+client = Client()
+print(json.dumps({
+    'apps': settings.INSTALLED_APPS,
+    'middleware': settings.MIDDLEWARE,
+    'schema': client.get('/openapi.json').json(),
+    'admin': client.get('/admin/').status_code,
+}))
+"""
+
+    @unittest.skipIf(settings.API_ONLY, 'drf_yasg is not installed in API_ONLY profile')
+    def test_openapi_schema_up_to_date(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'openapi.json')
+            call_command('generate_swagger', path, stdout=StringIO())
+            with open(path) as generated, open(settings.OPENAPI_SCHEMA_PATH) as precomputed:
+                self.assertEqual(json.load(precomputed), json.load(generated),
+                                 'Regenerate it: python manage.py generate_swagger -o openapi.json')
+
+    def test_api_only_profile(self):
+        env = {**os.environ, 'API_ONLY': '1', 'DJANGO_SETTINGS_MODULE': 'core.settings'}
+        output = subprocess.run(
+            [sys.executable, '-c', self.API_ONLY_SCRIPT],
+            env=env, capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout
+        result = json.loads(output)
+        self.assertNotIn('django.contrib.admin', result['apps'])
+        self.assertNotIn('drf_yasg', result['apps'])
+        self.assertNotIn('django.contrib.sessions.middleware.SessionMiddleware', result['middleware'])
+        self.assertEqual(result['admin'], HTTP_404_NOT_FOUND)
+        with open(settings.OPENAPI_SCHEMA_PATH) as file:
+            self.assertEqual(result['schema'], json.load(file))
+
+
+class FastJSONTests(TestCase):
+    DATA = ReturnList([
+        {'id': 1, 'content': 'zażółć \u2028 \u2029 "quoted" \\ </script>', 'views': 0, 'ok': True, 'none': None},
+        {
+            'created_at': datetime.datetime(2021, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'date': datetime.date(2021, 5, 1),
+            'time': datetime.time(12, 30, 15, 123456),
+            'decimal': Decimal('1.50'),
+            'uuid': uuid.UUID(int=1),
+            'lazy': gettext_lazy('text'),
+            'nested': OrderedDict([('b', [1, 2.5, (3, 4)]), ('a', {})]),
+        },
+    ], serializer=None)
+
+    BODY = '{"content": "zażółć", "ids": [1, 2], "nested": {"ok": true}}'.encode()
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_renderer_output_matches_json_renderer(self):
+        for data in [self.DATA, {'big': 2 ** 70}, {1: 'non-string key'}, [], None]:
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data), data)
+        indented = 'application/json; indent=4'
+        self.assertEqual(FastJSONRenderer().render(self.DATA, indented), JSONRenderer().render(self.DATA, indented))
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_parser(self):
+        self.assertEqual(FastJSONParser().parse(BytesIO(self.BODY)), JSONParser().parse(BytesIO(self.BODY)))
+        for invalid in [b'{"content": ', b'NaN', b'\xff']:
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(BytesIO(invalid))
+
+    def test_fallback_without_orjson(self):
+        with mock.patch('core.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.DATA), JSONRenderer().render(self.DATA))
+            self.assertEqual(FastJSONParser().parse(BytesIO(self.BODY)), JSONParser().parse(BytesIO(self.BODY)))
+
+    def test_api_uses_fast_json(self):
+        user = User.objects.create(username='test', password='testing123')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/api/messages/bulk', data=['first', 'drugi \u2028 wiersz'], format='json')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        response = client.get('/api/messages')
+        self.assertIn(b'drugi \\u2028 wiersz', response.content)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
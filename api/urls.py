@@ -1,8 +1,16 @@
 from django.urls import path
 
-from api.views import GetUpdateDeleteMessageAPIView, ListCreateMessageAPIView
+from api.views import (
+    BulkMessagesAPIView, ExportMessagesAPIView, GetUpdateDeleteMessageAPIView, ListCreateMessageAPIView,
+    MessageChangesAPIView, SearchMessagesAPIView, TopMessagesAPIView,
+)
 
 urlpatterns = [
     path('messages', ListCreateMessageAPIView.as_view()),
+    path('messages/bulk', BulkMessagesAPIView.as_view()),
+    path('messages/changes', MessageChangesAPIView.as_view()),
+    path('messages/export', ExportMessagesAPIView.as_view()),
+    path('messages/search', SearchMessagesAPIView.as_view()),
+    path('messages/top', TopMessagesAPIView.as_view()),
     path('messages/<int:id>', GetUpdateDeleteMessageAPIView.as_view()),
 ]
@@ -1,34 +1,113 @@
+import copy
+
+from django.conf import settings
+from django.db import transaction
 from django.db.models import F
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.generics import RetrieveUpdateDestroyAPIView, ListCreateAPIView
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.generics import GenericAPIView, RetrieveUpdateDestroyAPIView, ListCreateAPIView
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 
-from api.models import Message
-from api.serializers import MessageSerializer
+from api.archive import is_archived, restore_message, restore_messages
+from api.cache import detail_key, get_cache, invalidate_messages, list_key, recently_written
+from api.changes import changes_since, wait_for_changes
+from api.coalescing import message_reads
+from api.conditional import (
+    if_match_versions, list_validators, message_etag, not_modified, page_validators, set_validators,
+)
+from api.counters import get_view_counter
+from api.export import export_queryset, iter_ndjson
+from api.leaderboard import top_messages, update_leaderboard
+from api.models import ArchivedMessage, Message
+from api.pagination import MessageCursorPagination, MessageSearchPagination
+from api.search import MessageSearch
+from api.serializers import (
+    MESSAGE_FIELDS, BulkDeleteMessagesSerializer, ExportMessagesSerializer, ListMessagesSerializer,
+    MessageChangesSerializer, MessageSerializer, SearchMessagesSerializer, TopMessagesSerializer,
+    serialize_message_columns, serialize_messages,
+)
+from core.routers import replica_reads
 
 
 class ListCreateMessageAPIView(ListCreateAPIView):
     """
     Allowed methods: GET, POST
     GET   api/messages  - lists all messages
+                          (paginated with ?page_size=<n> and ?cursor=<cursor>,
+                          only ?fields=<field,...>, as parallel arrays with ?layout=columns)
     POST  api/messages  - creates message with given content
     """
-    queryset = Message.objects.all().order_by('-updated_at')
+    queryset = Message.objects.all().order_by('-updated_at', '-id')
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = MessageCursorPagination
 
     def list(self, request, *args, **kwargs):
         """GET method handler
-        Inherits default behaviour of ListCreateAPIView's list method
+        Responds with 304 if client's ETag is still valid (If-Modified-Since is not evaluated,
+        as Last-Modified does not change when messages are deleted).
+        Serialized pages are cached together with their validators if messages cache is enabled.
+        `?fields=id,views` returns only given fields, `?layout=columns` returns them as parallel arrays.
+        Messages are read from a replica if there are any (see `core.routers`).
+        """
+        options = ListMessagesSerializer(data=request.query_params)
+        options.is_valid(raise_exception=True)
+        cache = get_cache()
+        key = list_key(cache, request) if cache is not None else None
+        entry = cache.get(key) if cache is not None else None
+        # cached pages are shared, they are not read from replicas which may miss a recent write
+        shared_stale = cache is not None and bool(settings.DATABASE_REPLICAS) and recently_written(cache)
+        with replica_reads(request, enabled=not shared_stale):
+            page = None
+            if entry is None:
+                fields = options.validated_data['fields']
+                page = self.get_page(fields)
+                if page is not None:
+                    links = (self.paginator.has_next, self.paginator.has_previous)
+                    etag, last_modified = page_validators(page, request, views='views' in fields, links=links)
+                else:
+                    etag, last_modified = list_validators(self.filter_queryset(self.get_queryset()), request,
+                                                          views='views' in fields)
+                entry = (None, etag, last_modified)
+
+            data, etag, last_modified = entry
+            response = not_modified(request, etag)
+            if response is None:
+                if data is None:
+                    data = self.get_list_data(page, **options.validated_data)
+                    if cache is not None:
+                        cache.set(key, (data, etag, last_modified))
+                response = Response(data, status=status.HTTP_200_OK)
+        return set_validators(response, etag, last_modified)
+
+    def get_page(self, fields=MESSAGE_FIELDS):
+        """Returns rows of the requested page with columns of `fields`, None if pagination is not requested."""
+        if self.paginator is None or not self.paginator.is_requested(self.request):
+            return None
+        # cursor and validators of the page are made of rows' updated_at and id
+        columns = tuple(dict.fromkeys(fields + ('id', 'updated_at')))
+        return self.paginate_queryset(self.filter_queryset(self.get_queryset()).values_list(*columns, named=True))
+
+    def get_list_data(self, page, fields=MESSAGE_FIELDS, layout='rows'):
+        """Same as ListCreateAPIView's list method, but selects only requested columns
+        and serializes them with fast read-only path of MessageSerializer.
+        `page` comes from `get_page`, the whole list is read if it is None.
         """
-        return super().list(request, *args, **kwargs)
+        serialize = serialize_message_columns if layout == 'columns' else serialize_messages
+        if page is not None:
+            return self.get_paginated_response(serialize(page, fields)).data
+        return serialize(self.filter_queryset(self.get_queryset()).values_list(*fields, named=True), fields)
 
     def create(self, request, *args, **kwargs):
         """POST method handler.
         Inherits default behaviour of ListCreateAPIView's create method
         """
-        return super().create(request, *args, **kwargs)
+        response = super().create(request, *args, **kwargs)
+        invalidate_messages([response.data['id']])
+        update_leaderboard.delay([response.data])
+        return response
 
 
 class GetUpdateDeleteMessageAPIView(RetrieveUpdateDestroyAPIView):
@@ -46,29 +125,257 @@ class GetUpdateDeleteMessageAPIView(RetrieveUpdateDestroyAPIView):
         return Message.objects.filter(id=self.kwargs[self.lookup_field])
 
     def retrieve(self, request, *args, **kwargs):
-        """GET method handler - retrieve message with given id"""
+        """GET method handler - retrieve message with given id
+        Responds with 304 if client's ETag/Last-Modified are still valid, it counts as a view as well.
+        """
         qs = self.get_queryset()
-        if not qs.exists():
+        counter = get_view_counter()
+        if counter is not None:
+            # buffered views: read the row (or its cached payload), count the view in the buffer
+            # and include views which are not flushed yet, so the client sees its own view
+            cache = get_cache()
+            entry = cache.get(detail_key(self.kwargs[self.lookup_field])) if cache is not None else None
+            if entry is None:
+                entry, _, _ = self.coalesce(self.load_entry)
+                if entry is None:
+                    return self.retrieve_archived(request)
+            data, etag, last_modified = entry
+            data = {**data, 'views': data['views'] + counter.incr(data['id'])}
+            update_leaderboard([data])
+            response = not_modified(request, etag, last_modified)
+            if response is None:
+                response = Response(data, status=status.HTTP_200_OK)
+            return set_validators(response, etag, last_modified)
+
+        # increment with F expression to avoid race conditions and get the updated row back
+        # in the same statement (there will be only one object since id is unique)
+        messages, index, callers = self.coalesce(qs.increment_views)
+        if not messages:
+            return self.retrieve_archived(request)
+        message = messages[0]
+        if callers > 1:
+            # the row was fetched for several requests, but only the first one has been counted
+            if index == 0:
+                qs.update(views=F('views') + callers - 1)
+            message = copy.copy(message)
+            message.views += index
+        data = self.get_serializer(message).data
+        update_leaderboard([data])
+        etag = message_etag(message)
+        response = not_modified(request, etag, message.updated_at)
+        if response is None:
+            response = Response(data, status=status.HTTP_200_OK)
+        return set_validators(response, etag, message.updated_at)
+
+    def retrieve_archived(self, request):
+        """Serves message moved to the archive (see `api.archive`), its view is counted in the archive."""
+        messages = ArchivedMessage.objects.filter(id=self.kwargs[self.lookup_field]).increment_views()
+        if not messages:
             return Response({'error': 'Message not found!'}, status=status.HTTP_404_NOT_FOUND)
+        message = messages[0]
+        etag = message_etag(message)
+        response = not_modified(request, etag, message.updated_at)
+        if response is None:
+            response = Response(self.get_serializer(message).data, status=status.HTTP_200_OK)
+        return set_validators(response, etag, message.updated_at)
+
+    def load_entry(self):
+        """Returns (serialized message, ETag, Last-Modified) of requested message, None if it does not exist."""
+        instance = self.get_queryset().first()
+        if instance is None:
+            return None
+        entry = (self.get_serializer(instance).data, message_etag(instance), instance.updated_at)
+        cache = get_cache()
+        if cache is not None:
+            cache.set(detail_key(instance.id), entry)
+        return entry
 
-        qs.update(views=F('views') + 1)  # use F expression to avoid race conditions
-        instance = qs.first()  # there will be only one object since id is unique
-        return Response(self.get_serializer(instance).data, status=status.HTTP_200_OK)
+    def coalesce(self, func):
+        """Returns (result, index, callers) of `func` shared by concurrent reads of the message
+        (see `api.coalescing`), or of its own call if `MESSAGES_COALESCE_READS` is off.
+        """
+        if not settings.MESSAGES_COALESCE_READS:
+            return func(), 0, 1
+        return message_reads.do(self.kwargs[self.lookup_field], func)
 
     def update(self, request, *args, **kwargs):
-        """PUT/PATCH method handler - update message with given id"""
-        message = self.get_object()
-        serializer = self.get_serializer(message, data={
+        """PUT/PATCH method handler - update message with given id
+        Message is updated with a single conditional UPDATE (no SELECT, no locks held),
+        with If-Match header only if it still has one of the given versions (ETags), 412 otherwise.
+        """
+        pk = self.kwargs[self.lookup_field]
+        serializer = self.get_serializer(data={
             'content': request.data.get('content'),
             'views': 0,
         })
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            if not self.get_queryset().exists() and not is_archived(pk):
+                raise Http404
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        versions = if_match_versions(request, pk)
+        if versions is None and settings.MESSAGES_REQUIRE_IF_MATCH and 'HTTP_IF_MATCH' not in request.META:
+            return Response({'error': 'If-Match header is required.'}, status=status.HTTP_428_PRECONDITION_REQUIRED)
+        queryset = self.get_queryset() if versions is None else self.get_queryset().filter(version__in=versions)
+        messages = queryset.update_returning(
+            content=serializer.validated_data['content'],
+            views=0,
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        )
+        if not messages:
+            current = self.get_queryset().first()
+            if current is None:
+                if restore_message(pk):
+                    return self.update(request, *args, **kwargs)
+                raise Http404
+            response = Response({'error': 'Message has been modified by someone else.'},
+                                status=status.HTTP_412_PRECONDITION_FAILED)
+            return set_validators(response, message_etag(current), current.updated_at)
+
+        message = messages[0]
+        counter = get_view_counter()
+        if counter is not None:
+            counter.discard(message.id)
+        data = self.get_serializer(message).data
+        invalidate_messages([message.id])
+        update_leaderboard.delay([data])
+        return set_validators(Response(data, status=status.HTTP_200_OK), message_etag(message), message.updated_at)
 
     def delete(self, request, *args, **kwargs):
         """DELETE method handler - delete message with given id
-        Inherits default behaviour of DestroyAPIView's delete method.
+        Inherits default behaviour of DestroyAPIView's delete method (archived message is restored first).
+        """
+        try:
+            response = super().delete(request, *args, **kwargs)
+        except Http404:
+            if not restore_message(self.kwargs[self.lookup_field]):
+                raise
+            response = super().delete(request, *args, **kwargs)
+        invalidate_messages([self.kwargs[self.lookup_field]])
+        update_leaderboard.delay(removed=[self.kwargs[self.lookup_field]])
+        return response
+
+
+class BulkMessagesAPIView(GenericAPIView):
+    """
+    Allowed methods: POST, DELETE
+    POST    api/messages/bulk  - creates messages from array of contents (or message objects)
+    DELETE  api/messages/bulk  - deletes messages with ids given as {"ids": [...]}
+    """
+    serializer_class = MessageSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        """POST method handler - validates all messages and creates them in one transaction.
+        Returns created messages or list of errors (one object per item) if any of them is invalid.
+        """
+        if not isinstance(request.data, list):
+            return Response({'error': 'Expected a list of messages.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.MESSAGES_BULK_MAX_ITEMS:
+            return Response({'error': f'Too many messages, max {settings.MESSAGES_BULK_MAX_ITEMS} allowed.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        data = [{'content': item} if isinstance(item, str) else item for item in request.data]
+        serializer = self.get_serializer(data=data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer.save()
+        invalidate_messages([])
+        update_leaderboard.delay(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, *args, **kwargs):
+        """DELETE method handler - deletes existing (hot or archived) messages from given ids"""
+        serializer = BulkDeleteMessagesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+
+        with transaction.atomic():
+            deleted = set(Message.objects.filter(id__in=ids).values_list('id', flat=True))
+            # archived messages are restored first, like in single DELETE, so that their deletion is logged
+            deleted.update(restore_messages(set(ids) - deleted))
+            Message.objects.filter(id__in=deleted).delete()
+        invalidate_messages(deleted)
+        update_leaderboard.delay(removed=sorted(deleted))
+        return Response({
+            'deleted': sorted(deleted),
+            'not_found': sorted(set(ids) - deleted),
+        }, status=status.HTTP_200_OK)
+
+
+class ExportMessagesAPIView(GenericAPIView):
+    """
+    Allowed methods: GET
+    GET  api/messages/export  - streams all messages as NDJSON, oldest first
+                                (optionally only ?updated_since=<datetime>&updated_until=<datetime>)
+    """
+    serializer_class = ExportMessagesSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """GET method handler - streams messages without loading them all into memory"""
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        lines = iter_ndjson(export_queryset(**serializer.validated_data), settings.MESSAGES_EXPORT_CHUNK_SIZE)
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+
+class SearchMessagesAPIView(GenericAPIView):
+    """
+    Allowed methods: GET
+    GET  api/messages/search?q=<words>  - messages containing all given words, best matches first
+                                          (paginated with ?page=<n> and ?page_size=<n>)
+    """
+    serializer_class = SearchMessagesSerializer
+    pagination_class = MessageSearchPagination
+
+    def get(self, request, *args, **kwargs):
+        """GET method handler - ranked full-text search over message content"""
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        page = self.paginate_queryset(MessageSearch(serializer.validated_data['q']))
+        return self.get_paginated_response(serialize_messages(page))
+
+
+class TopMessagesAPIView(GenericAPIView):
+    """
+    Allowed methods: GET
+    GET  api/messages/top?n=<n>  - n (default 10) most viewed messages
+    """
+    serializer_class = TopMessagesSerializer
+
+    def get(self, request, *args, **kwargs):
+        """GET method handler - most viewed messages, newer first when views are equal"""
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(top_messages(serializer.validated_data['n']), status=status.HTTP_200_OK)
+
+
+class MessageChangesAPIView(GenericAPIView):
+    """
+    Allowed methods: GET
+    GET  api/messages/changes?since=<cursor>  - messages created or updated and ids of messages deleted
+                                                after the cursor, oldest change first
+                                                (?limit=<n> changes, ?wait=<seconds> to long-poll)
+    """
+    serializer_class = MessageChangesSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """GET method handler - returns changes after `since` and cursor to ask for the next ones.
+        With `wait` and no changes yet, waits up to `wait` seconds for them (async view waits on its own).
         """
-        return super().delete(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        since = serializer.validated_data['since']
+        wait = serializer.validated_data['wait']
+        if wait and not getattr(request._request, 'changes_awaited', False):
+            wait_for_changes(since, wait)
+        cursor, has_more, messages, deleted = changes_since(since, serializer.validated_data['limit'])
+        return Response({
+            'cursor': cursor,
+            'has_more': has_more,
+            'messages': serialize_messages(messages),
+            'deleted': deleted,
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTTokenUserAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from core.metrics import timed
+
+
+class ExpiringLRUCache:
+    """Thread-safe LRU cache, every entry has its own expiry time (unix timestamp)."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication which remembers verified tokens and users resolved from them.
+
+    Clients reusing the same access token skip signature verification, claims decoding
+    and the User query. Tokens are cached until their `exp`, users until their token expires
+    but at most `JWT_AUTH_USER_TTL` seconds (so that deactivation of a user takes effect).
+    Both caches are bounded LRUs of `JWT_AUTH_CACHE_SIZE` entries per process.
+
+    With `JWT_AUTH_TOKEN_USER` enabled, users are not loaded from database at all
+    and `request.user` is a stateless TokenUser built from token claims.
+    """
+    tokens = ExpiringLRUCache(settings.JWT_AUTH_CACHE_SIZE)
+    users = ExpiringLRUCache(settings.JWT_AUTH_CACHE_SIZE)
+
+    @classmethod
+    def clear_cache(cls):
+        cls.tokens.clear()
+        cls.users.clear()
+
+    @timed('auth')
+    def authenticate(self, request):
+        return super().authenticate(request)
+
+    def get_validated_token(self, raw_token):
+        validated_token = self.tokens.get(raw_token)
+        if validated_token is None:
+            validated_token = super().get_validated_token(raw_token)
+            self.tokens.set(raw_token, validated_token, expires_at=validated_token['exp'])
+        return validated_token
+
+    def get_user(self, validated_token):
+        if settings.JWT_AUTH_TOKEN_USER:
+            return JWTTokenUserAuthentication.get_user(self, validated_token)
+
+        key = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = self.users.get(key) if key is not None else None
+        if user is None:
+            user = super().get_user(validated_token)
+            expires_at = min(validated_token['exp'], time.time() + settings.JWT_AUTH_USER_TTL)
+            self.users.set(key, user, expires_at=expires_at)
+        return user
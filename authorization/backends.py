@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from authorization.hashers import check_password, make_password
+
+UserModel = get_user_model()
+
+
+class HashingPoolModelBackend(ModelBackend):
+    """ModelBackend which verifies passwords in the hashing pool (see `authorization.hashers`)."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # run the hasher anyway to reduce the timing difference
+            # between an existing and a nonexistent user (same as ModelBackend)
+            make_password(password)
+            return None
+        if check_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,79 @@
+"""Password hashers with cost taken from settings and a bounded pool for hashing.
+
+Tuned hashers keep the algorithm names of Django's hashers, so existing hashes stay valid,
+and they report hashes made with different cost as outdated - Django rehashes them
+with current settings on the next successful login.
+
+Hashing is CPU-bound and slow on purpose. With `AUTH_HASHING_THREADS` set, registrations
+and logins hash passwords in a pool of that many threads, so that bursts of signups
+cannot occupy all CPUs of the host and starve the other requests (hashlib, argon2 and bcrypt
+release the GIL while hashing). With `AUTH_HASHING_THREADS = 0` passwords are hashed inline.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model, hashers
+
+from core.executors import get_executor
+from core.tasks import task
+
+
+class TunedPBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class TunedPBKDF2SHA1PasswordHasher(hashers.PBKDF2SHA1PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class TunedArgon2PasswordHasher(hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class TunedBCryptSHA256PasswordHasher(hashers.BCryptSHA256PasswordHasher):
+    @property
+    def rounds(self):
+        return settings.PASSWORD_BCRYPT_ROUNDS
+
+
+def run_hashing(func, *args):
+    """Calls `func(*args)` in the hashing pool (or inline if it is disabled) and returns its result."""
+    if not settings.AUTH_HASHING_THREADS:
+        return func(*args)
+    return get_executor('password-hashing', settings.AUTH_HASHING_THREADS).submit(func, *args).result()
+
+
+def make_password(password):
+    """Same as `django.contrib.auth.hashers.make_password`, hashed in the hashing pool."""
+    return run_hashing(hashers.make_password, password)
+
+
+def check_password(user, password):
+    """Same as `user.check_password(password)`, hashed in the hashing pool.
+    Outdated hash is upgraded by a background task (see `core.tasks`), so the login does not wait for it.
+    """
+    outdated = []
+    valid = run_hashing(hashers.check_password, password, user.password, outdated.append)
+    if valid and outdated:
+        upgrade_password_hash.delay(user.pk, user.password, password)
+    return valid
+
+
+@task(local=True)
+def upgrade_password_hash(user_id, encoded, password):
+    """Saves new hash of `password` unless the password has been changed since `encoded` was read.
+    Local task - the raw password is never stored in the task queue.
+    """
+    get_user_model().objects.filter(pk=user_id, password=encoded).update(password=make_password(password))
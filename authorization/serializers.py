@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
 
+from authorization.hashers import make_password
+
 
 class RegisterUserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -11,10 +13,10 @@ class RegisterUserSerializer(serializers.ModelSerializer):
         }
 
     def create(self, validated_data):
-        user = User.objects.create_user(
-            validated_data['username'],
-            password=validated_data['password'],
-        )
+        # same as User.objects.create_user, but the password is hashed in the hashing pool
+        user = User(username=User.normalize_username(validated_data['username']))
+        user.password = make_password(validated_data['password'])
+        user.save()
         return user
 
 
@@ -1,8 +1,15 @@
+import time
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.test import TestCase
-from rest_framework.status import HTTP_200_OK
+from django.test import TestCase, override_settings
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_401_UNAUTHORIZED
 
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authorization.authentication import CachedJWTAuthentication, ExpiringLRUCache
+from authorization.hashers import check_password
 
 
 class AuthViewsTests(TestCase):
@@ -46,3 +53,97 @@ class AuthViewsTests(TestCase):
         data = response.json()
         self.assertIn('access', data)
         self.assertNotEqual(access, data['access'])
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    MESSAGES_URL = 'http://127.0.0.1:8000/api/messages'
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        CachedJWTAuthentication.clear_cache()
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user(username='test', password='testing123')
+
+    def post_message(self, token):
+        return self.client.post(self.MESSAGES_URL, data={'content': 'Test'}, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_user_cached_for_token(self):
+        token = AccessToken.for_user(self.user)
+        with self.assertNumQueries(2):  # user + insert
+            self.assertEqual(self.post_message(token).status_code, HTTP_201_CREATED)
+        with self.assertNumQueries(1):  # insert
+            self.assertEqual(self.post_message(token).status_code, HTTP_201_CREATED)
+
+    @override_settings(JWT_AUTH_TOKEN_USER=True)
+    def test_token_user(self):
+        token = AccessToken.for_user(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.post_message(token).status_code, HTTP_201_CREATED)
+
+    def test_inactive_user_not_cached(self):
+        token = AccessToken.for_user(self.user)
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertEqual(self.post_message(token).status_code, HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.post_message(token).status_code, HTTP_401_UNAUTHORIZED)
+
+    def test_invalid_token(self):
+        self.assertEqual(self.post_message('invalid').status_code, HTTP_401_UNAUTHORIZED)
+
+    def test_expiring_lru_cache(self):
+        cache = ExpiringLRUCache(maxsize=2)
+        cache.set('a', 1, expires_at=time.time() + 60)
+        cache.set('b', 2, expires_at=time.time() + 60)
+        cache.get('a')
+        cache.set('c', 3, expires_at=time.time() + 60)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+        cache.set('d', 4, expires_at=time.time() - 1)
+        self.assertIsNone(cache.get('d'))
+
+
+class PasswordHashingTests(TestCase):
+    TOKEN_URL = 'http://127.0.0.1:8000/api/auth/token/'
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.user = User.objects.create_user(username='test', password='testing123')
+
+    def get_token(self, password='testing123'):
+        return self.client.post(self.TOKEN_URL, data={'username': 'test', 'password': password})
+
+    @override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_iterations_from_settings(self):
+        self.assertTrue(make_password('testing123').startswith('pbkdf2_sha256$1000$'))
+
+    def test_outdated_hash_upgraded_on_login(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            User.objects.filter(id=self.user.id).update(password=make_password('testing123'))
+
+        self.assertEqual(self.get_token().status_code, HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$260000$'))
+        self.assertTrue(self.user.check_password('testing123'))
+
+    def test_wrong_password_not_upgraded(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            User.objects.filter(id=self.user.id).update(password=make_password('testing123'))
+
+        self.assertEqual(self.get_token('wrong').status_code, HTTP_401_UNAUTHORIZED)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+    @override_settings(AUTH_HASHING_THREADS=2)
+    def test_hashing_pool(self):
+        response = self.client.post('http://127.0.0.1:8000/api/auth/register/', data={
+            'username': 'Tester',
+            'password': 'testing123',
+        })
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertTrue(check_password(User.objects.get(username='Tester'), 'testing123'))
+        self.assertEqual(self.get_token().status_code, HTTP_200_OK)
+        self.assertEqual(self.get_token('wrong').status_code, HTTP_401_UNAUTHORIZED)
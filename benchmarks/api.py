@@ -0,0 +1,245 @@
+"""Load test of API endpoints - every flow is run through Django's test client and/or a live local server.
+
+Driven by `python manage.py benchmark` (see `api/management/commands/benchmark.py`),
+which prints JSON results that can be compared across commits with `--compare`.
+"""
+import json
+import platform
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.utils import seed_messages, summarize
+
+FLOWS = ('list', 'detail', 'hot', 'create', 'update', 'delete', 'register', 'token')
+AUTH_FLOWS = ('register', 'token')
+PASSWORD = 'benchmark123'
+
+
+class QueryCounter:
+    """Counts queries executed by all database connections (installed as execute wrapper)."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+class ClientTransport:
+    """Sends requests through Django's test client (whole request/response cycle, no HTTP)."""
+    name = 'client'
+
+    def __init__(self):
+        from django.test import Client
+
+        self.client = Client()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        body = json.dumps(data) if data is not None else None
+        response = getattr(self.client, method.lower())(path, data=body, content_type='application/json', **headers)
+        return response.status_code
+
+
+class LiveServerTransport:
+    """Sends HTTP requests to a live server running in a background thread of this process."""
+    name = 'live'
+
+    def __init__(self):
+        from django.db import connections
+        from django.test.testcases import LiveServerThread, _StaticFilesHandler
+
+        # in-memory SQLite test database can only be shared with the server thread by its connection
+        self.shared_connections = {
+            connection.alias: connection for connection in connections.all()
+            if connection.vendor == 'sqlite' and connection.is_in_memory_db()
+        }
+        for connection in self.shared_connections.values():
+            connection.inc_thread_sharing()
+        self.server = LiveServerThread('localhost', _StaticFilesHandler, self.shared_connections, port=0)
+        self.server.daemon = True
+        self.server.start()
+        self.server.is_ready.wait()
+        if self.server.error:
+            raise self.server.error
+        self.base_url = f'http://localhost:{self.server.port}'
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    def close(self):
+        self.server.terminate()
+        self.server.join()
+        for connection in self.shared_connections.values():
+            connection.dec_thread_sharing()
+
+
+class Benchmark:
+    """Prepares data for all flows and runs them."""
+
+    def __init__(self, messages, requests, auth_requests):
+        from django.contrib.auth.models import User
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        from api.models import Message
+
+        self.requests = requests
+        self.auth_requests = auth_requests
+        seed_messages(messages)
+        self.message_ids = list(Message.objects.order_by('id').values_list('id', flat=True))
+        self.user = User.objects.create_user(username='benchmark', password=PASSWORD)
+        self.token = str(AccessToken.for_user(self.user))
+        self.registered = 0
+
+    def requests_of(self, flow):
+        """Returns list of (method, path, data, token) to send in given flow."""
+        count = self.auth_requests if flow in AUTH_FLOWS else self.requests
+        ids = self.message_ids
+        if flow == 'list':
+            return [('GET', '/api/messages?page_size=50', None, None)] * count
+        if flow == 'detail':
+            return [('GET', f'/api/messages/{ids[i * 7919 % len(ids)]}', None, None) for i in range(count)]
+        if flow == 'hot':
+            # one message read by everybody (see MESSAGES_COALESCE_READS)
+            return [('GET', f'/api/messages/{ids[0]}', None, None)] * count
+        if flow == 'create':
+            return [('POST', '/api/messages', {'content': f'Created {i}'}, self.token) for i in range(count)]
+        if flow == 'update':
+            return [('PUT', f'/api/messages/{ids[i * 7919 % len(ids)]}', {'content': f'Updated {i}'}, self.token)
+                    for i in range(count)]
+        if flow == 'delete':
+            # every message is deleted only once, taken from the end of seeded ones
+            deleted, self.message_ids = ids[-count:], ids[:-count]
+            return [('DELETE', f'/api/messages/{pk}', None, self.token) for pk in deleted]
+        if flow == 'register':
+            start, self.registered = self.registered, self.registered + count
+            return [('POST', '/api/auth/register/', {'username': f'benchmark{i}', 'password': PASSWORD}, None)
+                    for i in range(start, start + count)]
+        if flow == 'token':
+            return [('POST', '/api/auth/token/', {'username': 'benchmark', 'password': PASSWORD}, None)] * count
+        raise ValueError(f'Unknown flow: {flow!r}')
+
+    def run_flow(self, flow, transport, counter, concurrency):
+        requests = self.requests_of(flow)
+        if flow == 'delete' and not requests:
+            raise ValueError('Not enough seeded messages to delete.')
+
+        def send(request):
+            start = time.perf_counter()
+            status = transport.request(*request)
+            return time.perf_counter() - start, status
+
+        queries = counter.count
+        start = time.perf_counter()
+        if concurrency == 1:
+            results = [send(request) for request in requests]
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(send, requests))
+        elapsed = time.perf_counter() - start
+        durations = [duration for duration, _ in results]
+        return {
+            'flow': flow,
+            'transport': transport.name,
+            'concurrency': concurrency,
+            'requests': len(requests),
+            'errors': sum(1 for _, status in results if status >= 400),
+            'throughput_rps': round(len(requests) / elapsed, 1),
+            'queries_per_request': round((counter.count - queries) / len(requests), 2),
+            **summarize(durations),
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(messages=10000, requests=200, auth_requests=10, flows=FLOWS, transports=('client',), concurrency=1):
+    """Seeds `messages` and runs every flow with every transport, returns JSON serializable report."""
+    import django
+    from django.db import connection, connections
+    from django.db.backends.signals import connection_created
+
+    counter = QueryCounter()
+
+    def install_counter(connection, **kwargs):
+        if counter not in connection.execute_wrappers:
+            connection.execute_wrappers.append(counter)
+
+    # live server threads open their own connections
+    connection_created.connect(install_counter)
+    for conn in connections.all():
+        install_counter(conn)
+
+    try:
+        benchmark = Benchmark(messages, requests, auth_requests)
+        results = []
+        for name in transports:
+            if name == 'live':
+                transport = LiveServerTransport()
+                # connection shared with the server thread (in-memory SQLite) cannot be used concurrently
+                flow_concurrency = 1 if transport.shared_connections else concurrency
+            else:
+                # test client runs views in the calling thread with its connection
+                transport, flow_concurrency = ClientTransport(), 1
+            try:
+                for flow in flows:
+                    results.append(benchmark.run_flow(flow, transport, counter, flow_concurrency))
+            finally:
+                if name == 'live':
+                    transport.close()
+    finally:
+        connection_created.disconnect(install_counter)
+        for conn in connections.all():
+            if counter in conn.execute_wrappers:
+                conn.execute_wrappers.remove(counter)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'messages': messages,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """Adds relative change against `baseline` report (p50 latency and throughput) to every result."""
+    previous = {(result['flow'], result['transport']): result for result in baseline['results']}
+    for result in report['results']:
+        base = previous.get((result['flow'], result['transport']))
+        if base is None:
+            continue
+        result['baseline'] = {
+            'commit': baseline['meta'].get('commit'),
+            'p50_ms': base['p50_ms'],
+            'throughput_rps': base['throughput_rps'],
+            'p50_change_pct': round((result['p50_ms'] / base['p50_ms'] - 1) * 100, 1),
+            'throughput_change_pct': round((result['throughput_rps'] / base['throughput_rps'] - 1) * 100, 1),
+        }
+    return report
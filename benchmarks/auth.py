@@ -0,0 +1,79 @@
+"""Measures registration and token obtain throughput with different password hashing cost.
+
+Usage: python -m benchmarks.auth [--requests 20] [--hasher pbkdf2] [--pbkdf2-iterations 260000 100000]
+       python -m benchmarks.auth --hasher argon2 --argon2-time-cost 2 1   (requires argon2-cffi)
+"""
+import argparse
+import json
+import time
+
+from benchmarks.utils import setup_django, summarize, test_database
+
+HASHERS = {
+    'pbkdf2': 'authorization.hashers.TunedPBKDF2PasswordHasher',
+    'argon2': 'authorization.hashers.TunedArgon2PasswordHasher',
+    'bcrypt': 'authorization.hashers.TunedBCryptSHA256PasswordHasher',
+}
+HASHER_SETTINGS = {
+    'pbkdf2': 'PASSWORD_PBKDF2_ITERATIONS',
+    'argon2': 'PASSWORD_ARGON2_TIME_COST',
+    'bcrypt': 'PASSWORD_BCRYPT_ROUNDS',
+}
+
+
+def run_endpoint(client, url, payloads):
+    durations = []
+    start_all = time.perf_counter()
+    for payload in payloads:
+        start = time.perf_counter()
+        response = client.post(url, data=payload)
+        durations.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.content
+    elapsed = time.perf_counter() - start_all
+    return {**summarize(durations), 'throughput_rps': round(len(payloads) / elapsed, 1)}
+
+
+def run(requests, hasher, costs):
+    from django.test import Client, override_settings
+
+    client = Client()
+    results = []
+    for cost in costs:
+        with override_settings(PASSWORD_HASHERS=[HASHERS[hasher]], **{HASHER_SETTINGS[hasher]: cost}):
+            payloads = [{'username': f'bench-{hasher}-{cost}-{i}', 'password': 'benchmark123'} for i in range(requests)]
+            results.append({
+                'hasher': hasher,
+                HASHER_SETTINGS[hasher]: cost,
+                'endpoint': 'POST api/auth/register/',
+                **run_endpoint(client, '/api/auth/register/', payloads),
+            })
+            results.append({
+                'hasher': hasher,
+                HASHER_SETTINGS[hasher]: cost,
+                'endpoint': 'POST api/auth/token/',
+                **run_endpoint(client, '/api/auth/token/', payloads),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--hasher', choices=list(HASHER_SETTINGS), default='pbkdf2')
+    parser.add_argument('--pbkdf2-iterations', type=int, nargs='+', default=[260000, 100000])
+    parser.add_argument('--argon2-time-cost', type=int, nargs='+', default=[2, 1])
+    parser.add_argument('--bcrypt-rounds', type=int, nargs='+', default=[12, 10])
+    args = parser.parse_args()
+
+    costs = {
+        'pbkdf2': args.pbkdf2_iterations,
+        'argon2': args.argon2_time_cost,
+        'bcrypt': args.bcrypt_rounds,
+    }[args.hasher]
+    setup_django()
+    with test_database():
+        print(json.dumps(run(args.requests, args.hasher, costs), indent=2))
+
+
+if __name__ == '__main__':
+    main()
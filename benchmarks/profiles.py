@@ -0,0 +1,89 @@
+"""Compares the full deployment with the `API_ONLY=1` profile: worker cold start and request latency.
+
+Every profile runs in its own interpreter:
+    startup  - time to import Django, load settings and apps and build the WSGI application (median of --starts)
+    requests - `manage.py benchmark` of chosen flows through the test client
+
+Usage: python -m benchmarks.profiles [--starts 5] [--requests 500] [--flows list detail create]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from core.wsgi import application
+from django.conf import settings
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({
+    'startup_ms': (time.perf_counter() - start) * 1000,
+    'modules': len(sys.modules),
+    'apps': len(settings.INSTALLED_APPS),
+    'middleware': len(settings.MIDDLEWARE),
+}))
+'''
+
+PROFILES = {
+    'full': {},
+    'api_only': {'API_ONLY': '1'},
+}
+
+
+def environment(profile):
+    env = {key: value for key, value in os.environ.items() if key != 'API_ONLY'}
+    env.setdefault('SECRET_KEY', 'benchmarks')
+    return {**env, 'DJANGO_SETTINGS_MODULE': 'core.settings', **PROFILES[profile]}
+
+
+def measure_startup(profile, starts):
+    results = []
+    for _ in range(starts):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT],
+            env=environment(profile), capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output))
+    return {
+        'startup_ms': round(statistics.median(result['startup_ms'] for result in results), 1),
+        'modules': results[0]['modules'],
+        'apps': results[0]['apps'],
+        'middleware': results[0]['middleware'],
+    }
+
+
+def measure_requests(profile, requests, flows):
+    output = subprocess.run(
+        [sys.executable, 'manage.py', 'benchmark', '--messages', '5000', '--requests', str(requests),
+         '--transports', 'client', '--flows', *flows],
+        env=environment(profile), capture_output=True, text=True, check=True,
+    ).stdout
+    return {
+        result['flow']: {key: result[key] for key in ('p50_ms', 'p99_ms', 'throughput_rps')}
+        for result in json.loads(output)['results']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--starts', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--flows', nargs='+', default=['list', 'detail', 'create'])
+    args = parser.parse_args()
+
+    results = {
+        profile: {
+            **measure_startup(profile, args.starts),
+            'requests': measure_requests(profile, args.requests, args.flows),
+        }
+        for profile in PROFILES
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
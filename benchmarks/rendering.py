@@ -0,0 +1,68 @@
+"""Compares DRF's JSONRenderer/JSONParser with the orjson backed ones (`core/renderers.py`).
+
+Renders messages list payloads (as returned by the list endpoint) and parses bulk create payloads.
+
+Usage: python -m benchmarks.rendering [--sizes 1000 10000 100000] [--repeat 5]
+"""
+import argparse
+import io
+import json
+
+from benchmarks.utils import measure, seed_messages, setup_django, summarize, test_database
+
+
+def run(sizes, repeat):
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from api.models import Message
+    from api.serializers import MESSAGE_FIELDS, serialize_messages
+    from core.renderers import FastJSONParser, FastJSONRenderer, orjson
+
+    if orjson is None:
+        raise SystemExit('orjson is not installed, FastJSONRenderer would only measure the fallback.')
+
+    results = []
+    seeded = 0
+    for size in sorted(sizes):
+        seed_messages(size - seeded)
+        seeded = size
+        rows = Message.objects.order_by('-updated_at', '-id').values_list(*MESSAGE_FIELDS, named=True)[:size]
+        data = serialize_messages(rows)
+        rendered = JSONRenderer().render(data)
+        assert FastJSONRenderer().render(data) == rendered
+        body = JSONRenderer().render([{'content': message['content']} for message in data])
+
+        scenarios = {
+            'render': (lambda: JSONRenderer().render(data), lambda: FastJSONRenderer().render(data)),
+            'parse': (
+                lambda: JSONParser().parse(io.BytesIO(body)),
+                lambda: FastJSONParser().parse(io.BytesIO(body)),
+            ),
+        }
+        for scenario, (baseline, optimized) in scenarios.items():
+            baseline, optimized = summarize(measure(baseline, repeat)), summarize(measure(optimized, repeat))
+            results.append({
+                'scenario': scenario,
+                'messages': size,
+                'bytes': len(rendered) if scenario == 'render' else len(body),
+                'json': baseline,
+                'orjson': optimized,
+                'speedup': round(baseline['p50_ms'] / optimized['p50_ms'], 2),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        print(json.dumps(run(args.sizes, args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Compares MessageSerializer with the fast read-only serialization path.
+
+Usage: python -m benchmarks.serialization [--sizes 1000 10000 100000] [--repeat 5]
+"""
+import argparse
+import json
+
+from benchmarks.utils import measure, seed_messages, setup_django, summarize, test_database
+
+
+def run(sizes, repeat):
+    from django.db import connection
+
+    from api.models import Message
+    from api.serializers import MESSAGE_FIELDS, MessageSerializer, serialize_messages
+
+    results = []
+    seeded = 0
+    for size in sorted(sizes):
+        seed_messages(size - seeded)
+        seeded = size
+        queryset = Message.objects.order_by('-updated_at', '-id')[:size]
+        instances = list(queryset)
+        rows = list(queryset.values_list(*MESSAGE_FIELDS, named=True))
+        assert json.dumps(MessageSerializer(instances, many=True).data) == json.dumps(serialize_messages(rows))
+
+        scenarios = {
+            # serialization of already fetched rows
+            'serialize': (
+                lambda: MessageSerializer(instances, many=True).data,
+                lambda: serialize_messages(rows),
+            ),
+            # fetching and serialization, as done by the list endpoint
+            'fetch_and_serialize': (
+                lambda: MessageSerializer(queryset, many=True).data,
+                lambda: serialize_messages(queryset.values_list(*MESSAGE_FIELDS, named=True)),
+            ),
+        }
+        for scenario, (baseline, optimized) in scenarios.items():
+            baseline, optimized = summarize(measure(baseline, repeat)), summarize(measure(optimized, repeat))
+            results.append({
+                'scenario': scenario,
+                'rows': size,
+                'database': connection.vendor,
+                'message_serializer': baseline,
+                'fast_path': optimized,
+                'speedup': round(baseline['p50_ms'] / optimized['p50_ms'], 2),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        print(json.dumps(run(args.sizes, args.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
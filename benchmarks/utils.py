@@ -0,0 +1,96 @@
+"""Helpers shared by benchmark scripts.
+
+Benchmarks create their own throwaway test database (`test_<NAME>`, in memory for SQLite),
+so they never touch the data of configured database.
+"""
+import contextlib
+import math
+import os
+import statistics
+import time
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmarks')
+    import django
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database(verbosity=0):
+    """Creates test database for the duration of the block."""
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def seed_messages(count, batch_size=5000):
+    """Inserts `count` messages.
+    PostgreSQL and SQLite generate the rows in the database with one INSERT ... SELECT,
+    other databases get bulk INSERTs of `batch_size` rows.
+    """
+    from django.db import connection
+    from django.utils import timezone
+
+    from api.models import Message
+
+    if count <= 0:
+        return
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    if connection.vendor == 'postgresql':
+        sql = (
+            'INSERT INTO api_message (content, views, version, created_at, updated_at) '
+            "SELECT 'Benchmark message ' || i, 0, 1, %s, %s FROM generate_series(0, %s - 1) AS i"
+        )
+    elif connection.vendor == 'sqlite':
+        sql = (
+            'WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < %s) '
+            'INSERT INTO api_message (content, views, version, created_at, updated_at) '
+            "SELECT 'Benchmark message ' || i, 0, 1, %s, %s FROM seq"
+        )
+    else:
+        for start in range(0, count, batch_size):
+            Message.objects.bulk_create(
+                [Message(content=f'Benchmark message {i}') for i in range(start, min(start + batch_size, count))],
+                batch_size=batch_size,
+            )
+        return
+
+    params = [now, now, count] if connection.vendor == 'postgresql' else [count, now, now]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def measure(func, repeat=5):
+    """Calls func `repeat` times, returns list of durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def percentile(values, percent):
+    """Returns `percent` percentile of values (nearest rank)."""
+    ordered = sorted(values)
+    index = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(durations):
+    """Returns dict with latency statistics (milliseconds) of given durations (seconds)."""
+    return {
+        'count': len(durations),
+        'mean_ms': round(statistics.mean(durations) * 1000, 3),
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3),
+        'min_ms': round(min(durations) * 1000, 3),
+    }
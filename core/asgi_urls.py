@@ -0,0 +1,12 @@
+"""MessagesAPI URL Configuration for ASGI deployments (MESSAGES_ASYNC_VIEWS=1)
+
+Message list, detail and change feed endpoints are served by async views (see `api/async_views.py`),
+all other urls are the same as in `core/urls.py`.
+"""
+from django.urls import path, include
+
+from core.urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/', include('api.async_urls')),
+] + sync_urlpatterns
@@ -0,0 +1,33 @@
+"""Bounded thread pools shared by the process (async views, password hashing, background tasks).
+
+Every pool is created on first use with the size it is first asked for and lives as long as the process.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name, max_workers):
+    """Returns thread pool `name` (also the prefix of its thread names) of `max_workers` threads."""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+                _executors[name] = executor
+    return executor
+
+
+def run_in_pool(func, *args, **kwargs):
+    """Calls `func` in a pool thread, then closes database connections of the thread which are not usable anymore
+    (pool threads are not covered by request_started/request_finished handlers).
+    """
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
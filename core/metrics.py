@@ -0,0 +1,181 @@
+"""Per-request performance metrics (see `core.middleware.InstrumentationMiddleware`).
+
+Timings of the current request are kept in a context variable, so that code deep in the views
+(database wrapper, serializers, authentication) can record into it without passing it around.
+Outside of instrumented requests, recording functions only check the context variable.
+
+Metrics are aggregated per process (every worker exposes its own numbers on `/metrics`).
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+# seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TIMED_PHASES = ('db', 'serialize', 'auth')
+
+
+class RequestTimings:
+    """Durations (seconds) of request's phases and number of its database queries."""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.db_queries = 0
+        self.running = set()
+
+    def server_timing(self, total):
+        """Returns value of Server-Timing header (durations in milliseconds)."""
+        metrics = [f'total;dur={total * 1000:.2f}']
+        metrics.append(f'db;dur={self.durations["db"] * 1000:.2f};desc="{self.db_queries} queries"')
+        for phase in TIMED_PHASES[1:]:
+            if phase in self.durations:
+                metrics.append(f'{phase};dur={self.durations[phase] * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+def timed(phase):
+    """Decorator adding duration of the function to `phase` of the current request.
+    Nested calls (e.g. list serializer calling item serializer) are counted once.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = current_timings.get()
+            if timings is None or phase in timings.running:
+                return func(*args, **kwargs)
+            timings.running.add(phase)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.durations[phase] += time.perf_counter() - start
+                timings.running.discard(phase)
+        return wrapper
+    return decorator
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper, records queries of instrumented requests."""
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.durations['db'] += time.perf_counter() - start
+        timings.db_queries += 1
+
+
+def install_query_recorder(connection, **kwargs):
+    """Adds `record_query` to execute wrappers of the connection (`connection_created` receiver)."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Histograms of request phases and counters of requests/queries per (route, method),
+    counters of background tasks per (task, outcome) and depth of the task queue (see `core.tasks`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.requests = defaultdict(int)
+        self.db_queries = defaultdict(int)
+        self.tasks = defaultdict(int)
+        self.task_queue = 0
+
+    def observe(self, route, method, status, total, timings):
+        with self._lock:
+            durations = {'request': total, **{phase: timings.durations[phase] for phase in TIMED_PHASES}}
+            for phase, duration in durations.items():
+                key = (phase, route, method)
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(DURATION_BUCKETS)
+                self.histograms[key].observe(duration)
+            self.requests[(route, method, status)] += 1
+            self.db_queries[(route, method)] += timings.db_queries
+
+    def count_task(self, name, outcome):
+        with self._lock:
+            self.tasks[(name, outcome)] += 1
+
+    def task_queue_depth(self, change):
+        with self._lock:
+            self.task_queue += change
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.requests.clear()
+            self.db_queries.clear()
+            self.tasks.clear()
+
+    def render(self):
+        """Returns metrics in Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+            for phase in ('request',) + TIMED_PHASES:
+                name = f'messages_api_{phase}_duration_seconds'
+                lines.append(f'# HELP {name} Time spent in {phase} phase of sampled requests.')
+                lines.append(f'# TYPE {name} histogram')
+                for (key_phase, route, method), histogram in sorted(self.histograms.items()):
+                    if key_phase != phase:
+                        continue
+                    labels = f'route="{route}",method="{method}"'
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {cumulative}')
+
+            lines.append('# HELP messages_api_requests_total Sampled requests.')
+            lines.append('# TYPE messages_api_requests_total counter')
+            for (route, method, status), count in sorted(self.requests.items()):
+                labels = f'route="{route}",method="{method}",status="{status}"'
+                lines.append(f'messages_api_requests_total{{{labels}}} {count}')
+
+            lines.append('# HELP messages_api_db_queries_total Database queries of sampled requests.')
+            lines.append('# TYPE messages_api_db_queries_total counter')
+            for (route, method), count in sorted(self.db_queries.items()):
+                lines.append(f'messages_api_db_queries_total{{route="{route}",method="{method}"}} {count}')
+
+            lines.append('# HELP messages_api_tasks_total Background tasks by outcome.')
+            lines.append('# TYPE messages_api_tasks_total counter')
+            for (name, outcome), count in sorted(self.tasks.items()):
+                lines.append(f'messages_api_tasks_total{{task="{name}",outcome="{outcome}"}} {count}')
+            lines.append('# HELP messages_api_task_queue_depth Background tasks waiting for a thread of the pool.')
+            lines.append('# TYPE messages_api_task_queue_depth gauge')
+            lines.append(f'messages_api_task_queue_depth {self.task_queue}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def metrics_view(request):
+    """Exposes metrics of this process for Prometheus (404 if instrumentation is disabled)."""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
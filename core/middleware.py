@@ -0,0 +1,167 @@
+import asyncio
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from core.metrics import RequestTimings, current_timings, install_query_recorder, registry
+from core.routers import pin_to_primary
+
+
+class AsyncCapableMiddleware:
+    """Base of middleware which runs in the mode of the rest of the chain, sync (WSGI) or async (ASGI),
+    so Django does not have to adapt it (every sync middleware in an ASGI chain costs a thread switch per request).
+    Subclasses handle sync requests in `__call__` and async ones in `__acall__`.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # asyncio.iscoroutinefunction(middleware) is true then, as for Django's MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class DatabaseHealthCheckMiddleware(AsyncCapableMiddleware):
+    """Checks persistent database connections before they are reused.
+
+    With CONN_MAX_AGE > 0 every worker keeps its connection open between requests,
+    but Django notices that the connection has been dropped (database restart, idle timeout
+    of the server or pgbouncer) only when a query fails. Connections which have been idle for more than
+    `DB_HEALTH_CHECK_INTERVAL` seconds are pinged first and closed if they are not usable anymore,
+    so Django transparently opens a new one.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DB_HEALTH_CHECK_INTERVAL:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.interval = settings.DB_HEALTH_CHECK_INTERVAL
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        self.close_unusable_connections()
+        response = self.get_response(request)
+        self.mark_connections_used()
+        return response
+
+    async def __acall__(self, request):
+        # connections belong to the thread of sync views (async views close theirs in `core.executors`)
+        await sync_to_async(self.close_unusable_connections)()
+        response = await self.get_response(request)
+        await sync_to_async(self.mark_connections_used)()
+        return response
+
+    def close_unusable_connections(self):
+        now = time.monotonic()
+        for connection in connections.all():
+            if connection.connection is None:
+                continue
+            last_used = getattr(connection, 'health_check_last_used', now)
+            if now - last_used > self.interval and not connection.is_usable():
+                connection.close()
+
+    def mark_connections_used(self):
+        now = time.monotonic()
+        for connection in connections.all():
+            if connection.connection is not None:
+                connection.health_check_last_used = now
+
+
+class InstrumentationMiddleware(AsyncCapableMiddleware):
+    """Records wall time, database queries (count and time), serialization and authentication time
+    of requests (see `core.metrics`).
+
+    Timings are returned in `Server-Timing` header (unless `METRICS_SERVER_TIMING` is disabled)
+    and aggregated into per route histograms exposed on `/metrics`.
+    Only `METRICS_SAMPLE_RATE` fraction of requests is instrumented, the rest passes through untouched.
+    Without `METRICS_ENABLED` the middleware is not loaded at all.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.sample_rate = settings.METRICS_SAMPLE_RATE
+        self.server_timing = settings.METRICS_SERVER_TIMING
+        connection_created.connect(install_query_recorder, dispatch_uid='core.metrics')
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.is_sampled():
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.record(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not self.is_sampled():
+            return await self.get_response(request)
+
+        # the context (with timings) is copied to threads running sync code of the request
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.record(request, response, timings, time.perf_counter() - start)
+
+    def is_sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, request, response, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        registry.observe(route, request.method, response.status_code, total, timings)
+        if self.server_timing:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
+
+
+class ReplicaPinMiddleware(AsyncCapableMiddleware):
+    """Pins clients to the primary database for a while after their successful writes,
+    so that they read their own writes although replicas lag behind (see `core.routers`).
+    Without `DATABASE_REPLICAS` the middleware is not loaded at all.
+    """
+    SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS', 'TRACE'}
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.is_successful_write(request, response):
+            pin_to_primary(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.is_successful_write(request, response):
+            await sync_to_async(pin_to_primary)(request)
+        return response
+
+    def is_successful_write(self, request, response):
+        # request.user is set by DRF authentication by now
+        return request.method not in self.SAFE_METHODS and response.status_code < 400
@@ -0,0 +1,21 @@
+"""OpenAPI schema of the API (generated by drf_yasg).
+
+`API_ONLY` deployments do not load drf_yasg, they serve `openapi.json` generated from this module:
+    python manage.py generate_swagger -o openapi.json
+"""
+from drf_yasg import openapi
+from drf_yasg.views import get_schema_view
+
+api_info = openapi.Info(
+    title="Messages API",
+    default_version='v1',
+    description="Messages API built as a recruitment task for DaftCode",
+    terms_of_service="https://www.google.com/policies/terms/",
+    license=openapi.License(name="BSD License"),
+    authentication_classes='rest_framework_simplejwt.authentication.JWTAuthentication'
+)
+
+schema_view = get_schema_view(
+    api_info,
+    public=True,
+)
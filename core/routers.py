@@ -0,0 +1,76 @@
+"""Routing of message list reads to read replicas (`DATABASE_ROUTERS` setting).
+
+Replicas are configured with `DATABASE_REPLICA_URLS` (aliases `replica1`, `replica2`, ...).
+Only reads of `Message` inside `replica_reads()` - the list of messages, by far the most frequent request -
+go to a randomly chosen replica (the same one for the whole block), everything else
+(writes, reads of single messages which count views, transactions) stays on the primary.
+
+Replicas lag behind the primary, so a client which has just written would not see its own write in the list.
+`ReplicaPinMiddleware` pins a client (user, or IP address of anonymous clients) to the primary for
+`DATABASE_REPLICA_PIN_SECONDS` after every successful write (read-your-writes).
+List pages read from replicas are shared by everyone through the messages cache, so while any write
+is that recent, list reads which fill the cache go to the primary as well (see `api.cache.recently_written`).
+
+Without replicas the router always returns None (default database) and the middleware is not loaded.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+_replica_alias = ContextVar('replica_alias', default=None)
+
+
+def pin_key(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'replica-pin:user:{user.pk}'
+    return f'replica-pin:ip:{request.META.get("REMOTE_ADDR")}'
+
+
+def pin_to_primary(request):
+    """Sends reads of the client of `request` to the primary for `DATABASE_REPLICA_PIN_SECONDS`."""
+    cache = caches[settings.DATABASE_REPLICA_PIN_CACHE_ALIAS]
+    cache.set(pin_key(request), True, timeout=settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    return bool(caches[settings.DATABASE_REPLICA_PIN_CACHE_ALIAS].get(pin_key(request)))
+
+
+@contextmanager
+def replica_reads(request, enabled=True):
+    """Reads of messages within the block go to one replica, unless the client is pinned to the primary.
+    The replica is chosen once for the block, so all its queries (e.g. validators and the page) see the same data.
+    Yields the alias of the replica or None.
+    """
+    use_replica = enabled and bool(settings.DATABASE_REPLICAS) and not is_pinned(request)
+    alias = random.choice(settings.DATABASE_REPLICAS) if use_replica else None
+    token = _replica_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _replica_alias.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _replica_alias.get()
+        if (alias is not None and model._meta.label == 'api.Message'
+                and not connections['default'].in_atomic_block):  # a transaction sees its own writes
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema from the primary by replication
+        return db not in settings.DATABASE_REPLICAS
@@ -13,6 +13,8 @@ import datetime
 import os
 from pathlib import Path
 
+import dj_database_url
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -27,6 +29,11 @@ DEBUG = False
 
 ALLOWED_HOSTS = ['*']
 
+# pure API deployment: without admin, sessions, CSRF, browsable API and Swagger UI
+# (OpenAPI schema is served from precomputed `OPENAPI_SCHEMA_PATH`)
+API_ONLY = os.environ.get('API_ONLY') == '1'
+OPENAPI_SCHEMA_PATH = os.environ.get('OPENAPI_SCHEMA_PATH', BASE_DIR / 'openapi.json')
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -47,7 +54,18 @@ INSTALLED_APPS = [
     'authorization',
 ]
 
+if API_ONLY:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in {
+        'django.contrib.admin',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+        'drf_yasg',
+        'django_extensions',
+    }]
+
 MIDDLEWARE = [
+    'core.middleware.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -56,9 +74,32 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.DatabaseHealthCheckMiddleware',
+    'core.middleware.ReplicaPinMiddleware',
 ]
 
-ROOT_URLCONF = 'core.urls'
+if API_ONLY:
+    # JWT authentication is done by DRF, API views are exempt from CSRF and do not render HTML
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in {
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    }]
+
+# per-request instrumentation: Server-Timing headers and Prometheus metrics on /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+# fraction of instrumented requests
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1))
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '1') == '1'
+
+# async message views for ASGI deployments (e.g. gunicorn with uvicorn workers)
+MESSAGES_ASYNC_VIEWS = os.environ.get('MESSAGES_ASYNC_VIEWS') == '1'
+# size of the thread pool running async message views
+MESSAGES_ASYNC_THREADS = int(os.environ.get('MESSAGES_ASYNC_THREADS', 32))
+
+ROOT_URLCONF = 'core.asgi_urls' if MESSAGES_ASYNC_VIEWS else 'core.urls'
 
 TEMPLATES = [
     {
@@ -101,6 +142,31 @@ if os.environ.get('GITHUB_WORKFLOW'):
         }
     }
 
+if os.environ.get('DATABASE_URL'):
+    DATABASES['default'] = dj_database_url.config()
+
+# read replicas (see core/routers.py): comma separated database URLs, e.g. sqlite:///replica.sqlite3
+for index, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')), start=1):
+    # tests run against the test database of the primary
+    DATABASES[f'replica{index}'] = {**dj_database_url.parse(url), 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# seconds for which reads of a client stay on the primary after its write (should exceed replication lag)
+DATABASE_REPLICA_PIN_SECONDS = float(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', 5))
+DATABASE_REPLICA_PIN_CACHE_ALIAS = os.environ.get('DATABASE_REPLICA_PIN_CACHE_ALIAS', 'default')
+
+# Persistent connections: seconds for which worker keeps its database connection open
+# between requests (0 - new connection for every request)
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+# connections idle longer than that are checked before they are reused (0 disables the checks)
+DB_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_HEALTH_CHECK_INTERVAL', 30))
+
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+    # pgbouncer in transaction pooling mode does not support server-side cursors
+    if os.environ.get('DB_PGBOUNCER') == '1':
+        database['DISABLE_SERVER_SIDE_CURSORS'] = True
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -119,6 +185,33 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# PASSWORD_HASHER selects algorithm of new hashes: 'pbkdf2', 'argon2' (requires argon2-cffi)
+# or 'bcrypt' (requires bcrypt). Hashes made with the other ones (or with different cost)
+# are still accepted and rehashed with current settings on login.
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 260000))
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 102400))
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 8))
+PASSWORD_BCRYPT_ROUNDS = int(os.environ.get('PASSWORD_BCRYPT_ROUNDS', 12))
+
+_password_hashers = {
+    'pbkdf2': 'authorization.hashers.TunedPBKDF2PasswordHasher',
+    'argon2': 'authorization.hashers.TunedArgon2PasswordHasher',
+    'bcrypt': 'authorization.hashers.TunedBCryptSHA256PasswordHasher',
+}
+PASSWORD_HASHERS = [_password_hashers.pop(PASSWORD_HASHER)] + list(_password_hashers.values()) + [
+    'authorization.hashers.TunedPBKDF2SHA1PasswordHasher',
+]
+
+# number of threads hashing passwords on registration and login, 0 hashes in the request thread
+AUTH_HASHING_THREADS = int(os.environ.get('AUTH_HASHING_THREADS', 0))
+
+AUTHENTICATION_BACKENDS = [
+    'authorization.backends.HashingPoolModelBackend',
+]
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -149,11 +242,109 @@ CORS_ALLOW_ALL_ORIGINS = True
 # authentication
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authorization.authentication.CachedJWTAuthentication',
+    ],
+    # orjson backed JSON (falls back to DRF's json module implementation when orjson is not installed)
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.AnonTokenBucketThrottle',
+        'core.throttling.UserTokenBucketThrottle',
     ],
 }
+if API_ONLY:
+    # browsable API needs templates and static files
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = ['core.renderers.FastJSONRenderer']
+
+SWAGGER_SETTINGS = {
+    'DEFAULT_INFO': 'core.openapi.api_info',
+}
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': datetime.timedelta(hours=2),
     'REFRESH_TOKEN_LIFETIME': datetime.timedelta(days=1),
 }
+
+# verified tokens and users cache of CachedJWTAuthentication
+JWT_AUTH_CACHE_SIZE = int(os.environ.get('JWT_AUTH_CACHE_SIZE', 10000))
+JWT_AUTH_USER_TTL = int(os.environ.get('JWT_AUTH_USER_TTL', 60))
+# authenticate with user built from token claims, without loading it from database
+JWT_AUTH_TOKEN_USER = os.environ.get('JWT_AUTH_TOKEN_USER') == '1'
+
+# messages list pagination
+MESSAGES_PAGINATE_BY_DEFAULT = os.environ.get('MESSAGES_PAGINATE_BY_DEFAULT') == '1'
+MESSAGES_PAGE_SIZE = int(os.environ.get('MESSAGES_PAGE_SIZE', 50))
+MESSAGES_MAX_PAGE_SIZE = int(os.environ.get('MESSAGES_MAX_PAGE_SIZE', 500))
+
+# reject updates of messages without If-Match header (428) - forces optimistic concurrency on all clients
+MESSAGES_REQUIRE_IF_MATCH = os.environ.get('MESSAGES_REQUIRE_IF_MATCH') == '1'
+
+# length of most viewed messages leaderboard (max `n` of api/messages/top)
+MESSAGES_TOP_SIZE = int(os.environ.get('MESSAGES_TOP_SIZE', 100))
+
+# change feed (api/messages/changes): max changes per response, max and poll interval of long-polling (seconds)
+MESSAGES_CHANGES_PAGE_SIZE = int(os.environ.get('MESSAGES_CHANGES_PAGE_SIZE', 1000))
+MESSAGES_CHANGES_MAX_WAIT = float(os.environ.get('MESSAGES_CHANGES_MAX_WAIT', 30))
+MESSAGES_CHANGES_POLL_INTERVAL = float(os.environ.get('MESSAGES_CHANGES_POLL_INTERVAL', 0.5))
+
+
+# share one database read between concurrent GETs of the same message (within a process)
+MESSAGES_COALESCE_READS = os.environ.get('MESSAGES_COALESCE_READS') == '1'
+
+# archive of old messages (manage.py archive_messages): age in days (by updated_at), messages moved per transaction
+MESSAGES_ARCHIVE_AFTER_DAYS = float(os.environ.get('MESSAGES_ARCHIVE_AFTER_DAYS', 365))
+MESSAGES_ARCHIVE_BATCH_SIZE = int(os.environ.get('MESSAGES_ARCHIVE_BATCH_SIZE', 1000))
+
+# buffered message view counter: '' (UPDATE on every GET), 'local' or 'sqlite'
+MESSAGES_VIEW_COUNTER = os.environ.get('MESSAGES_VIEW_COUNTER', '')
+MESSAGES_VIEW_COUNTER_PATH = os.environ.get('MESSAGES_VIEW_COUNTER_PATH', BASE_DIR / 'views.sqlite3')
+MESSAGES_VIEW_FLUSH_INTERVAL = float(os.environ.get('MESSAGES_VIEW_FLUSH_INTERVAL', 5))
+MESSAGES_VIEW_FLUSH_THRESHOLD = int(os.environ.get('MESSAGES_VIEW_FLUSH_THRESHOLD', 100))
+
+# background tasks (core/tasks.py): 'sync' (inline), 'thread' (in-process pool) or 'db' (manage.py run_worker)
+TASKS_MODE = os.environ.get('TASKS_MODE', 'sync')
+TASKS_THREADS = int(os.environ.get('TASKS_THREADS', 4))
+TASKS_QUEUE_SIZE = int(os.environ.get('TASKS_QUEUE_SIZE', 1000))
+TASKS_MAX_RETRIES = int(os.environ.get('TASKS_MAX_RETRIES', 3))
+TASKS_RETRY_DELAY = float(os.environ.get('TASKS_RETRY_DELAY', 1))
+# seconds after which a task claimed by a worker which died is run again
+TASKS_LEASE = int(os.environ.get('TASKS_LEASE', 300))
+TASKS_POLL_INTERVAL = float(os.environ.get('TASKS_POLL_INTERVAL', 1))
+
+# caches, LocMemCache evicts least recently used entries
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'messages': {
+        'BACKEND': os.environ.get('MESSAGES_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('MESSAGES_CACHE_LOCATION', 'messages'),
+        'TIMEOUT': int(os.environ.get('MESSAGES_CACHE_TIMEOUT', 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('MESSAGES_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+
+# rate limiting (token buckets, see core/throttling.py): '<requests>/<s|m|h|d>', empty disables it
+THROTTLE_ANON_RATE = os.environ.get('THROTTLE_ANON_RATE', '')
+THROTTLE_USER_RATE = os.environ.get('THROTTLE_USER_RATE', '')
+THROTTLE_CACHE_ALIAS = os.environ.get('THROTTLE_CACHE_ALIAS', 'default')
+
+# response cache of message endpoints
+MESSAGES_CACHE_ENABLED = os.environ.get('MESSAGES_CACHE_ENABLED') == '1'
+MESSAGES_CACHE_ALIAS = 'messages'
+
+# bulk messages endpoint
+MESSAGES_BULK_BATCH_SIZE = int(os.environ.get('MESSAGES_BULK_BATCH_SIZE', 500))
+MESSAGES_BULK_MAX_ITEMS = int(os.environ.get('MESSAGES_BULK_MAX_ITEMS', 5000))
+
+# streaming export of messages
+MESSAGES_EXPORT_CHUNK_SIZE = int(os.environ.get('MESSAGES_EXPORT_CHUNK_SIZE', 2000))
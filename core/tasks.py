@@ -0,0 +1,164 @@
+"""Background tasks for side effects of writes (leaderboard updates, view counter flushes, password rehashes).
+
+Functions decorated with `@task` can still be called directly, `func.delay(*args, **kwargs)` runs them
+according to `TASKS_MODE`:
+    sync   - immediately in the calling thread, exactly like a direct call (default)
+    thread - after the current transaction commits, in a bounded pool of `TASKS_THREADS` threads;
+             when `TASKS_QUEUE_SIZE` tasks are already waiting, the task runs once in the calling thread instead
+             (backpressure - requests get slower rather than memory growing without limit)
+    db     - stored in `api_task` in the current transaction and run by `python manage.py run_worker`,
+             so they survive restarts of the web workers; tasks declared with `local=True`
+             (they need memory of this process or arguments which must not be stored) use the thread pool
+Local tasks are submitted right away, they do not wait for the current transaction to commit.
+
+Failed tasks are retried up to `TASKS_MAX_RETRIES` times, `TASKS_RETRY_DELAY` seconds after the first failure
+and twice as long after every next one - a timer submits them again, no thread sleeps meanwhile.
+Task arguments must be JSON serializable in `db` mode.
+Enqueued, succeeded, retried, failed and inline (queue full) tasks and the queue depth are exported on `/metrics`.
+"""
+import datetime
+import functools
+import logging
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core import executors
+from core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# tasks waiting in the pool, see `TaskFunction.submit`
+_slots = threading.BoundedSemaphore(settings.TASKS_QUEUE_SIZE)
+
+
+def get_executor():
+    return executors.get_executor('tasks', settings.TASKS_THREADS)
+
+
+def retry_delay(attempt):
+    """Returns seconds to wait before retry after `attempt`-th failed attempt (1-based)."""
+    return settings.TASKS_RETRY_DELAY * 2 ** (attempt - 1)
+
+
+class TaskFunction:
+    """Function which can be run in the background, see `task`."""
+
+    def __init__(self, func, local):
+        self.func = func
+        self.local = local
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        functools.update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """Runs the task in the background (depending on `TASKS_MODE`)."""
+        mode = settings.TASKS_MODE
+        if mode == 'sync':
+            return self.func(*args, **kwargs)
+
+        registry.count_task(self.name, 'enqueued')
+        if self.local:
+            # local tasks work with memory of this process, not with writes of the current transaction
+            self.submit(args, kwargs)
+            return None
+        if mode == 'db':
+            from api.models import Task
+
+            Task.objects.create(name=self.name, args=list(args), kwargs=kwargs, run_at=timezone.now())
+            return None
+        transaction.on_commit(lambda: self.submit(args, kwargs))
+        return None
+
+    def submit(self, args, kwargs, attempt=1):
+        executor = get_executor()
+        if not _slots.acquire(blocking=False):
+            registry.count_task(self.name, 'inline')
+            self.run_once(args, kwargs, attempt)
+            return
+        registry.task_queue_depth(+1)
+        executor.submit(self.run_queued, args, kwargs, attempt)
+
+    def run_queued(self, args, kwargs, attempt):
+        registry.task_queue_depth(-1)
+        try:
+            executors.run_in_pool(self.run_once, args, kwargs, attempt)
+        finally:
+            _slots.release()
+
+    def run_once(self, args, kwargs, attempt):
+        """Runs the task once. A failed task is submitted again after `retry_delay(attempt)` seconds
+        by a timer, so neither pool threads nor requests (running it when the queue is full) sleep.
+        """
+        try:
+            self.func(*args, **kwargs)
+        except Exception:
+            if attempt > settings.TASKS_MAX_RETRIES:
+                registry.count_task(self.name, 'failed')
+                logger.exception('Task %s failed after %d attempts.', self.name, attempt)
+                return
+            registry.count_task(self.name, 'retried')
+            timer = threading.Timer(retry_delay(attempt), self.retry, (args, kwargs, attempt + 1))
+            timer.daemon = True
+            timer.start()
+        else:
+            registry.count_task(self.name, 'succeeded')
+
+    def retry(self, args, kwargs, attempt):
+        try:
+            self.submit(args, kwargs, attempt)
+        finally:
+            # the task may have run in the timer thread (queue full)
+            connections.close_all()
+
+
+def task(func=None, *, local=False):
+    """Decorator making `func` a task (`func.delay(...)` runs it in the background).
+    Tasks with `local=True` are never stored in the database, they always run in this process.
+    """
+    if func is None:
+        return functools.partial(task, local=local)
+    return TaskFunction(func, local)
+
+
+def run_due_tasks(limit=100):
+    """Runs up to `limit` stored tasks which are due (`db` mode), returns the number of claimed tasks.
+
+    A task is claimed by moving its `run_at` by `TASKS_LEASE` seconds with a conditional UPDATE,
+    so several workers never run the same task and a task of a crashed worker is run again after the lease.
+    Succeeded tasks are deleted, failed ones are scheduled for retry or marked as failed.
+    """
+    from api.models import Task
+
+    now = timezone.now()
+    claimed = 0
+    due = Task.objects.filter(failed=False, run_at__lte=now).order_by('run_at', 'id')[:limit]
+    for task_id, run_at in list(due.values_list('id', 'run_at')):
+        lease = now + datetime.timedelta(seconds=settings.TASKS_LEASE)
+        if not Task.objects.filter(id=task_id, run_at=run_at).update(run_at=lease):
+            continue  # claimed by another worker
+        claimed += 1
+        stored = Task.objects.get(id=task_id)
+        try:
+            import_string(stored.name).func(*stored.args, **stored.kwargs)
+        except Exception:
+            attempts = stored.attempts + 1
+            failed = attempts > settings.TASKS_MAX_RETRIES
+            registry.count_task(stored.name, 'failed' if failed else 'retried')
+            logger.exception('Task %s (%s) failed, attempt %d.', stored.name, task_id, attempts)
+            Task.objects.filter(id=task_id).update(
+                attempts=attempts,
+                failed=failed,
+                last_error=traceback.format_exc(),
+                run_at=timezone.now() + datetime.timedelta(seconds=retry_delay(attempts)),
+            )
+        else:
+            registry.count_task(stored.name, 'succeeded')
+            Task.objects.filter(id=task_id).delete()
+    return claimed
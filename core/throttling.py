@@ -0,0 +1,90 @@
+"""Token bucket rate limiting of API requests (DRF throttles, see `REST_FRAMEWORK` settings).
+
+Every client has a bucket of `<requests>` tokens which refills at `<requests>/<period>` tokens per second,
+every request takes one token and requests without a token get `429 Too Many Requests` with `Retry-After`.
+Bursts of up to `<requests>` requests are allowed, sustained traffic is limited to the rate.
+
+A bucket is a single (tokens, timestamp) pair in the `THROTTLE_CACHE_ALIAS` cache - one get and one set
+per request, unlike DRF's `SimpleRateThrottle`, which keeps (and filters) timestamps of all requests in the period.
+Updates are atomic within a process, with a cache shared by several processes the limit is approximate.
+
+Rates are set with `THROTTLE_ANON_RATE` (per client IP) and `THROTTLE_USER_RATE` (per authenticated user),
+e.g. `100/s` or `1000/min`, empty rate disables the throttle.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Returns (capacity, refill per second) of rate `<requests>/<s|m|h|d>` (period can be spelled out)."""
+    requests, period = rate.split('/')
+    capacity = int(requests)
+    return capacity, capacity / DURATIONS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Base class of token bucket throttles. Subclasses choose the client (cache key) and the rate setting."""
+    scope = None
+    rate_setting = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_cache_key(self, request, view):
+        """Returns key of the client's bucket, None if the request is not throttled by this class."""
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def allow_request(self, request, view):
+        rate = getattr(settings, self.rate_setting)
+        if not rate:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        capacity, refill = parse_rate(rate)
+        cache = caches[settings.THROTTLE_CACHE_ALIAS]
+        now = time.time()
+        with self._lock:
+            tokens, updated = cache.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # bucket expires when it would be full again
+            cache.set(key, (tokens, now), timeout=math.ceil((capacity - tokens) / refill) + 1)
+        self.wait_time = None if allowed else (1 - tokens) / refill
+        return allowed
+
+    def wait(self):
+        return self.wait_time
+
+
+class AnonTokenBucketThrottle(TokenBucketThrottle):
+    """Limits unauthenticated requests per client IP (`X-Forwarded-For` is used with `NUM_PROXIES` set)."""
+    scope = 'anon'
+    rate_setting = 'THROTTLE_ANON_RATE'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return f'throttle:{self.scope}:{self.get_ident(request)}'
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Limits authenticated requests per user, so all tokens of one user share a bucket."""
+    scope = 'user'
+    rate_setting = 'THROTTLE_USER_RATE'
+
+    def get_cache_key(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return None
+        return f'throttle:{self.scope}:{request.user.pk}'
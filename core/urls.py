@@ -13,26 +13,30 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.urls import path, include
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Messages API",
-        default_version='v1',
-        description="Messages API built as a recruitment task for DaftCode",
-        terms_of_service="https://www.google.com/policies/terms/",
-        license=openapi.License(name="BSD License"),
-        authentication_classes='rest_framework_simplejwt.authentication.JWTAuthentication'
-    ),
-    public=True,
-)
+from core.metrics import metrics_view
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path('api/auth/', include('authorization.urls')),
-    path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('metrics', metrics_view),
 ]
+
+if settings.API_ONLY:
+    from core.views import openapi_schema_view
+
+    urlpatterns += [
+        path('openapi.json', openapi_schema_view),
+    ]
+else:
+    from django.contrib import admin
+
+    from core.openapi import schema_view
+
+    urlpatterns += [
+        path('admin/', admin.site.urls),
+        path('openapi.json', schema_view.without_ui(cache_timeout=0), name='schema-json'),
+        path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    ]
@@ -0,0 +1,15 @@
+import functools
+
+from django.conf import settings
+from django.http import HttpResponse
+
+
+@functools.lru_cache(maxsize=None)
+def read_openapi_schema():
+    with open(settings.OPENAPI_SCHEMA_PATH, 'rb') as file:
+        return file.read()
+
+
+def openapi_schema_view(request):
+    """Serves precomputed OpenAPI schema (`API_ONLY` deployments, which do not load drf_yasg)."""
+    return HttpResponse(read_openapi_schema(), content_type='application/json')